@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件转移基准测试
+在临时目录中生成可复现的模拟目录树，测量扫描、分类、重名处理和转移的耗时，
+输出 JSON 报告，可以与之前的报告对比
+"""
+
+import os
+import sys
+import argparse
+import json
+import math
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from file_transfer_engine import FileTransferEngine, NameIndex
+
+
+# 报告格式版本，字段变化时递增
+REPORT_SCHEMA = 1
+
+# 可以运行的测试项目，按执行顺序排列
+BENCHMARKS = ['scan', 'scan_index', 'classify', 'collisions', 'copy', 'move']
+
+
+class TreeSpec:
+    """模拟目录树的形状
+
+    depth 和 fanout 决定目录结构（每层每个目录有 fanout 个子目录），files 个文件随机分布在各个目录中。
+    文件大小由 sizes 描述：fixed:字节数、uniform:最小:最大 或 lognormal:中位数:sigma。
+    code_ratio 和 other_ratio 分别是代码文件和未知类型文件的比例，其余为 FILE_TYPES 中的常用文件。
+    文件名从 name_pool 个名称中选取，不同目录中的同名文件在分类转移时会产生重名。
+    wechat_accounts 大于 0 时生成 "WeChat Files/wxid_N/Msg" 形式的微信目录，文件放在 Msg 下。
+    """
+
+    def __init__(self, depth=3, fanout=4, files=5000, sizes='lognormal:16384:1.5', code_ratio=0.1,
+                 other_ratio=0.1, name_pool=None, wechat_accounts=0, seed=1):
+        self.depth = depth
+        self.fanout = fanout
+        self.files = files
+        self.sizes = sizes
+        self.code_ratio = code_ratio
+        self.other_ratio = other_ratio
+        self.name_pool = name_pool or max(1, files // 4)
+        self.wechat_accounts = wechat_accounts
+        self.seed = seed
+        self._size_function = self.parse_sizes(sizes)
+
+    @staticmethod
+    def parse_sizes(text):
+        """把大小分布描述转换为 size(rnd) 函数，格式错误时抛出 ValueError"""
+        kind, _, args = text.partition(':')
+        try:
+            values = [float(v) for v in args.split(':')] if args else []
+            if kind == 'fixed':
+                size, = values
+                return lambda rnd: int(size)
+            if kind == 'uniform':
+                low, high = values
+                return lambda rnd: rnd.randint(int(low), int(high))
+            if kind == 'lognormal':
+                median, sigma = values
+                return lambda rnd: min(int(rnd.lognormvariate(math.log(median), sigma)), 256 * 1024 * 1024)
+        except ValueError:
+            pass
+        raise ValueError(f"大小分布格式不正确: {text}")
+
+    def to_dict(self):
+        return {
+            'depth': self.depth, 'fanout': self.fanout, 'files': self.files, 'sizes': self.sizes,
+            'code_ratio': self.code_ratio, 'other_ratio': self.other_ratio, 'name_pool': self.name_pool,
+            'wechat_accounts': self.wechat_accounts, 'seed': self.seed,
+        }
+
+    def _dirs(self, root):
+        """按层生成目录路径列表"""
+        dirs = [root]
+        level = [root]
+        for depth in range(self.depth):
+            level = [os.path.join(parent, f"d{depth}_{i}") for parent in level for i in range(self.fanout)]
+            dirs.extend(level)
+        return dirs
+
+    def _extensions(self):
+        """返回 (常用扩展名, 代码扩展名, 未知扩展名) 三组候选"""
+        common = [ext for extensions in FileTransferEngine.FILE_TYPES.values() for ext in extensions]
+        return common, FileTransferEngine.CODE_FILE_EXTENSIONS, ['.dat', '.tmp1', '.xyz', '']
+
+    def generate(self, root):
+        """在 root 下生成目录树，返回 (扫描用的源文件夹, 统计信息)
+
+        相同的参数总是生成相同的目录树和文件内容。
+        """
+        rnd = random.Random(self.seed)
+        common, code, other = self._extensions()
+        # 文件内容取自同一块随机数据的不同位置，生成速度快且各文件内容不同
+        block = rnd.randbytes(1024 * 1024)
+
+        if self.wechat_accounts:
+            source = os.path.join(root, 'WeChat Files')
+            dirs = []
+            for account in range(self.wechat_accounts):
+                account_dir = os.path.join(source, f"wxid_{account:04d}")
+                os.makedirs(os.path.join(account_dir, 'config'), exist_ok=True)
+                dirs.extend(self._dirs(os.path.join(account_dir, 'Msg')))
+        else:
+            source = os.path.join(root, 'source')
+            dirs = self._dirs(source)
+        for path in dirs:
+            os.makedirs(path, exist_ok=True)
+
+        total_bytes = 0
+        matching = 0
+        for _ in range(self.files):
+            roll = rnd.random()
+            if roll < self.code_ratio:
+                ext = rnd.choice(code)
+            elif roll < self.code_ratio + self.other_ratio:
+                ext = rnd.choice(other)
+            else:
+                ext = rnd.choice(common)
+                matching += 1
+            name = f"file_{rnd.randrange(self.name_pool)}{ext}"
+            path = os.path.join(rnd.choice(dirs), name)
+            size = self._size_function(rnd)
+            offset = rnd.randrange(len(block))
+            with open(path, 'wb') as f:
+                remaining = size
+                while remaining:
+                    chunk = block[offset:offset + remaining]
+                    f.write(chunk)
+                    remaining -= len(chunk)
+                    offset = 0
+            total_bytes += size
+
+        # 同名文件会覆盖，按实际生成的文件统计
+        files = sum(len(names) for _, _, names in os.walk(source))
+        return source, {'dirs': len(dirs), 'files': files, 'bytes': total_bytes, 'matching_generated': matching}
+
+
+def summarize(times, files=None, size=None):
+    """根据多次运行的耗时计算统计值"""
+    median = statistics.median(times)
+    result = {
+        'runs': len(times),
+        'times': [round(t, 6) for t in times],
+        'min': round(min(times), 6),
+        'median': round(median, 6),
+        'mean': round(sum(times) / len(times), 6),
+    }
+    if files is not None:
+        result['files'] = files
+        result['files_per_sec'] = round(files / median, 1) if median else None
+    if size is not None:
+        result['bytes'] = size
+        result['mb_per_sec'] = round(size / median / (1024 * 1024), 2) if median else None
+    return result
+
+
+class BenchmarkRunner:
+    """在工作目录中生成目录树并依次运行各个测试项目"""
+
+    def __init__(self, spec, workdir, repeat=3, log=None):
+        self.spec = spec
+        self.workdir = workdir
+        self.repeat = repeat
+        self.log = log or (lambda message: print(message, file=sys.stderr))
+        self.source = None
+        self.tree = None
+
+    def engine(self, target=''):
+        """创建不输出日志的引擎，增量扫描索引和源文件夹配置缓存放在工作目录中"""
+        engine = FileTransferEngine(target=target, on_log=lambda message: None)
+        engine.SCAN_INDEX_PATH = os.path.join(self.workdir, 'scan_index.sqlite3')
+        engine.SOURCE_PROFILE_CACHE_PATH = os.path.join(self.workdir, 'source_profiles.json')
+        return engine
+
+    def prepare(self):
+        started = time.perf_counter()
+        self.source, self.tree = self.spec.generate(os.path.join(self.workdir, 'tree'))
+        self.log(f"生成目录树: {self.tree['files']} 个文件，{self.tree['dirs']} 个目录，"
+                 f"耗时 {time.perf_counter() - started:.2f} 秒")
+
+    def timed(self, function):
+        """运行 repeat 次，返回每次的耗时和最后一次的结果"""
+        times = []
+        result = None
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            result = function()
+            times.append(time.perf_counter() - started)
+        return times, result
+
+    def bench_scan(self):
+        times, found = self.timed(lambda: len(self.engine().scan_files(self.source)))
+        return dict(summarize(times, files=self.tree['files']), matched=found)
+
+    def bench_scan_index(self):
+        index_path = self.engine().SCAN_INDEX_PATH
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        # 第一次建立索引，之后的运行都命中索引
+        self.engine().scan_files(self.source, use_index=True)
+        times, found = self.timed(lambda: len(self.engine().scan_files(self.source, use_index=True)))
+        return dict(summarize(times, files=self.tree['files']), matched=found)
+
+    def bench_classify(self):
+        names = [name for _, _, filenames in os.walk(self.source) for name in filenames]
+        engine = self.engine()
+
+        def classify():
+            for name in names:
+                if not engine.should_skip_file(name):
+                    engine.get_file_type(name)
+
+        times, _ = self.timed(classify)
+        result = summarize(times, files=len(names))
+        result['ns_per_file'] = round(result['median'] / len(names) * 1e9, 1) if names else None
+        return result
+
+    def bench_collisions(self):
+        names = [name for _, _, filenames in os.walk(self.source) for name in filenames]
+        target_dir = os.path.join(self.workdir, 'collisions')
+
+        def reserve():
+            index = NameIndex()
+            for name in names:
+                index.reserve(target_dir, name)
+            return len(names) - len(set(names))
+
+        times, collisions = self.timed(reserve)
+        return dict(summarize(times, files=len(names)), collisions=collisions)
+
+    def _transfer(self, mode, source, target):
+        engine = self.engine(target)
+        engine.scan_files(source)
+        matched = len(engine.scanned_files)
+        size = sum(max(file_info['size'] or 0, 0) for file_info in engine.scanned_files)
+        started = time.perf_counter()
+        success_count, fail_count = engine.transfer_files(source, target, mode)
+        return time.perf_counter() - started, matched, size, fail_count
+
+    def bench_copy(self):
+        times = []
+        for run in range(self.repeat):
+            target = os.path.join(self.workdir, f'copy_{run}')
+            elapsed, matched, size, failed = self._transfer('copy', self.source, target)
+            times.append(elapsed)
+            shutil.rmtree(target, ignore_errors=True)
+        return dict(summarize(times, files=matched, size=size), failed=failed)
+
+    def bench_move(self):
+        times = []
+        for run in range(self.repeat):
+            # 每次移动前复制一份源目录树，复制的耗时不计入
+            root = os.path.join(self.workdir, f'move_{run}')
+            source = os.path.join(root, os.path.basename(self.source))
+            shutil.copytree(self.source, source)
+            target = os.path.join(root, 'target')
+            elapsed, matched, size, failed = self._transfer('move', source, target)
+            times.append(elapsed)
+            shutil.rmtree(root, ignore_errors=True)
+        return dict(summarize(times, files=matched, size=size), failed=failed)
+
+    def run(self, names):
+        """运行指定的测试项目，返回报告字典"""
+        self.prepare()
+        results = {}
+        for name in names:
+            self.log(f"运行 {name} ...")
+            results[name] = getattr(self, f'bench_{name}')()
+            self.log(f"  {name}: 中位数 {results[name]['median']:.4f} 秒")
+        return {
+            'schema': REPORT_SCHEMA,
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'environment': environment(),
+            'spec': self.spec.to_dict(),
+            'tree': self.tree,
+            'repeat': self.repeat,
+            'results': results,
+        }
+
+
+def environment():
+    """记录运行环境，便于判断两份报告是否可比"""
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'scan_workers': FileTransferEngine.SCAN_WORKERS,
+        'transfer_workers': FileTransferEngine.TRANSFER_WORKERS,
+    }
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        if commit.returncode == 0:
+            info['commit'] = commit.stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return info
+
+
+def compare(report, baseline):
+    """比较两份报告中各项目的中位数耗时，返回 {项目: 新/旧 比值}"""
+    ratios = {}
+    for name, result in report['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if old and old.get('median'):
+            ratios[name] = round(result['median'] / old['median'], 3)
+    return ratios
+
+
+def main(argv=None):
+    """命令行入口，返回退出码"""
+    parser = argparse.ArgumentParser(prog='file_transfer_benchmark', description='文件转移工具基准测试')
+    parser.add_argument('--depth', type=int, default=3, help='目录深度')
+    parser.add_argument('--fanout', type=int, default=4, help='每个目录的子目录数')
+    parser.add_argument('--files', type=int, default=5000, help='文件数量')
+    parser.add_argument('--sizes', default='lognormal:16384:1.5',
+                        help='文件大小分布: fixed:N、uniform:最小:最大 或 lognormal:中位数:sigma（字节）')
+    parser.add_argument('--code-ratio', type=float, default=0.1, help='代码文件的比例')
+    parser.add_argument('--other-ratio', type=float, default=0.1, help='未知类型文件的比例')
+    parser.add_argument('--name-pool', type=int, help='文件名数量，越小重名越多，默认为文件数的四分之一')
+    parser.add_argument('--wechat', type=int, default=0, metavar='N', help='生成 N 个账号的微信目录结构')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--repeat', type=int, default=3, help='每个项目的运行次数')
+    parser.add_argument('--only', help='只运行指定的项目，逗号分隔: ' + ','.join(BENCHMARKS))
+    parser.add_argument('--workdir', help='生成目录树的位置，默认使用系统临时目录；测试结束后删除')
+    parser.add_argument('--output', help='报告文件，默认输出到标准输出')
+    parser.add_argument('--compare', metavar='BASELINE', help='与之前的报告比较')
+    parser.add_argument('--max-ratio', type=float,
+                        help='与 BASELINE 相比任一项目的耗时比值超过该值时返回退出码 1')
+    args = parser.parse_args(argv)
+
+    names = BENCHMARKS
+    if args.only:
+        names = [name.strip() for name in args.only.split(',') if name.strip()]
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            parser.error(f"未知的项目: {', '.join(sorted(unknown))}")
+    try:
+        spec = TreeSpec(args.depth, args.fanout, args.files, args.sizes, args.code_ratio, args.other_ratio,
+                        args.name_pool, args.wechat, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+
+    workdir = tempfile.mkdtemp(prefix='ftt_bench_', dir=args.workdir)
+    try:
+        report = BenchmarkRunner(spec, workdir, max(1, args.repeat)).run(names)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['comparison'] = {'baseline': args.compare, 'ratios': compare(report, baseline)}
+        for name, ratio in report['comparison']['ratios'].items():
+            print(f"{name}: {ratio:.3f}x", file=sys.stderr)
+            if args.max_ratio and ratio > args.max_ratio:
+                exit_code = 1
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3584 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件转移引擎
+不依赖图形界面的扫描和转移逻辑，供图形界面和命令行共同使用
+"""
+
+import os
+import sys
+import errno
+import threading
+import queue
+import time
+import re
+import json
+import fnmatch
+import bisect
+import importlib
+import importlib.util
+from array import array
+from collections import deque
+from types import MappingProxyType
+
+# 其余模块（sqlite3、hashlib、tarfile、shutil、cProfile 等）只在用到的函数中导入，命令行启动时不加载
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+# 可用于校验复制结果的摘要算法: 名称 -> (模块, 构造函数名)，计算摘要时才导入
+HASH_ALGORITHMS = {
+    'blake2b': ('hashlib', 'blake2b'),
+    'sha256': ('hashlib', 'sha256'),
+}
+if importlib.util.find_spec('xxhash') is not None:  # 可选依赖
+    HASH_ALGORITHMS['xxh3_128'] = ('xxhash', 'xxh3_128')
+
+
+def new_hasher(algorithm):
+    """创建 HASH_ALGORITHMS 中算法的摘要对象"""
+    module, name = HASH_ALGORITHMS[algorithm]
+    return getattr(importlib.import_module(module), name)()
+
+
+class ScanResults:
+    """紧凑的列式扫描结果存储
+
+    目录路径和文件类型各只保存一份并按编号引用，文件大小存放在 array('q') 中，
+    文件名和扩展名不再重复保存。索引和迭代时按需生成与原先相同的字典。
+    """
+
+    def __init__(self):
+        self.dirs = []  # 目录路径表
+        self._dir_ids = {}
+        self.type_names = []  # 文件类型表
+        self._type_ids = {}
+        self.dir_codes = array('L')
+        self.names = []
+        self.sizes = array('q')  # -1 表示大小未知
+        self.type_codes = array('B')
+
+    def _intern_type(self, file_type):
+        """返回文件类型的编号"""
+        code = self._type_ids.get(file_type)
+        if code is None:
+            code = self._type_ids[file_type] = len(self.type_names)
+            self.type_names.append(file_type)
+        return code
+
+    def add_dir(self, dirpath, files):
+        """添加一个目录下的扫描结果，files 为 (文件名, 大小, 类型) 列表"""
+        dir_code = self._dir_ids.get(dirpath)
+        if dir_code is None:
+            dir_code = self._dir_ids[dirpath] = len(self.dirs)
+            self.dirs.append(dirpath)
+        for filename, file_size, file_type in files:
+            self.dir_codes.append(dir_code)
+            self.names.append(filename)
+            self.sizes.append(-1 if file_size is None else file_size)
+            self.type_codes.append(self._intern_type(file_type))
+
+    def append(self, file_path, file_size, file_type):
+        """添加单个文件"""
+        dirpath, filename = os.path.split(file_path)
+        self.add_dir(dirpath, [(filename, file_size, file_type)])
+
+    def path(self, index):
+        """返回第 index 个文件的完整路径"""
+        return os.path.join(self.dirs[self.dir_codes[index]], self.names[index])
+
+    def file_type(self, index):
+        """返回第 index 个文件的类型"""
+        return self.type_names[self.type_codes[index]]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.names)
+        if not 0 <= index < len(self.names):
+            raise IndexError("扫描结果索引超出范围")
+        filename = self.names[index]
+        file_name, file_ext = os.path.splitext(filename)
+        file_size = self.sizes[index]
+        return {
+            'path': os.path.join(self.dirs[self.dir_codes[index]], filename),
+            'name': file_name,
+            'ext': file_ext.lower(),
+            'size': None if file_size < 0 else file_size,
+            'type': self.type_names[self.type_codes[index]]
+        }
+
+    def __iter__(self):
+        for index in range(len(self.names)):
+            yield self[index]
+
+    def subset(self, indexes):
+        """返回只包含 indexes 中的文件（按给定顺序）的 ScanResults，目录表和类型表与原结果共用"""
+        subset = ScanResults()
+        subset.dirs, subset._dir_ids = self.dirs, self._dir_ids
+        subset.type_names, subset._type_ids = self.type_names, self._type_ids
+        subset.dir_codes = array('L', [self.dir_codes[index] for index in indexes])
+        subset.names = [self.names[index] for index in indexes]
+        subset.sizes = array('q', [self.sizes[index] for index in indexes])
+        subset.type_codes = array('B', [self.type_codes[index] for index in indexes])
+        return subset
+
+
+class ScanResultIndex:
+    """扫描结果的内存索引，筛选和排序时不需要重新扫描
+
+    建立时把文件编号按类型分桶、按大小排序，并为文件名（不区分大小写）中每两个相邻字符建立
+    倒排表，中文文件名不需要分词也可以按任意子串查找。查询时先取候选最少的条件，其余条件直接
+    检查列式数据，耗时与候选数量成正比，而不是与扫描结果总数成正比。
+    """
+
+    def __init__(self, results):
+        self.results = results
+        sizes = results.sizes
+
+        self.type_buckets = {}  # 类型编号 -> 文件编号
+        for index, code in enumerate(results.type_codes):
+            bucket = self.type_buckets.get(code)
+            if bucket is None:
+                bucket = self.type_buckets[code] = array('L')
+            bucket.append(index)
+
+        # 大小未知 (-1) 的文件排在最前，大小相同时保持扫描顺序
+        self.size_order = array('L', sorted(range(len(results)), key=sizes.__getitem__))
+        self.sorted_sizes = array('q', [sizes[index] for index in self.size_order])
+
+        self.tokens = {}  # 文件名中相邻的两个字符 -> 文件编号
+        for index, name in enumerate(results.names):
+            name = name.lower()
+            for token in {name[i:i + 2] for i in range(len(name) - 1)}:
+                postings = self.tokens.get(token)
+                if postings is None:
+                    postings = self.tokens[token] = array('L')
+                postings.append(index)
+
+        self._name_order = None
+        self._path_order = None
+        self._dir_ranks = None
+
+    @property
+    def name_order(self):
+        """按文件名（不区分大小写）排列的文件编号，第一次按名称排序时生成"""
+        if self._name_order is None:
+            names = self.results.names
+            self._name_order = array('L', sorted(range(len(names)), key=lambda index: names[index].lower()))
+        return self._name_order
+
+    @property
+    def dir_ranks(self):
+        """目录编号 -> 目录路径（不区分大小写）的排序位置，第一次按路径排序时生成"""
+        if self._dir_ranks is None:
+            dirs = self.results.dirs
+            ranks = [0] * len(dirs)
+            for rank, code in enumerate(sorted(range(len(dirs)), key=lambda code: dirs[code].lower())):
+                ranks[code] = rank
+            self._dir_ranks = ranks
+        return self._dir_ranks
+
+    def path_key(self, index):
+        """按路径排序的键：先按所在目录，同一目录中再按文件名"""
+        return self.dir_ranks[self.results.dir_codes[index]], self.results.names[index].lower()
+
+    @property
+    def path_order(self):
+        """按路径排列的文件编号，第一次按路径排序时生成"""
+        if self._path_order is None:
+            self._path_order = array('L', sorted(range(len(self.results)), key=self.path_key))
+        return self._path_order
+
+    def query(self, file_types=None, min_size=None, max_size=None, name=None, sort=None, descending=False):
+        """返回符合条件的文件编号 array('L')
+
+        file_types 为类型名称集合，大小以字节为单位，name 为文件名中包含的文字（不区分大小写），
+        为 None 的条件不限；限定大小时不包括大小未知的文件。sort 为 None（扫描顺序）、'size'、'name' 或 'path'。
+        """
+        results = self.results
+        count = len(results)
+        # 候选: (数量, 编号序列, 是否按扫描顺序, 是否按大小顺序)
+        candidates = [(count, range(count), True, False)]
+
+        codes = None
+        if file_types is not None:
+            codes = {results._type_ids[file_type] for file_type in file_types if file_type in results._type_ids}
+            buckets = [self.type_buckets[code] for code in codes]
+            if len(buckets) == 1:
+                candidates.append((len(buckets[0]), buckets[0], True, False))
+            else:
+                merged = [index for bucket in buckets for index in bucket]
+                candidates.append((len(merged), merged, False, False))
+
+        sized = min_size is not None or max_size is not None
+        if sized:
+            min_size = max(min_size or 0, 0)
+            max_size = sys.maxsize if max_size is None else max_size
+            low = bisect.bisect_left(self.sorted_sizes, min_size)
+            high = bisect.bisect_right(self.sorted_sizes, max_size)
+            candidates.append((max(high - low, 0), self.size_order[low:high], False, True))
+
+        text = name.lower() if name else None
+        if text and len(text) >= 2:
+            # 任一相邻字符组合没有出现过时结果为空，否则取最短的倒排表作为候选
+            postings = [self.tokens.get(text[i:i + 2]) for i in range(len(text) - 1)]
+            if any(p is None for p in postings):
+                return array('L')
+            shortest = min(postings, key=len)
+            candidates.append((len(shortest), shortest, True, False))
+
+        _, driver, scan_ordered, size_ordered = min(candidates, key=lambda candidate: candidate[0])
+        type_codes, sizes, names = results.type_codes, results.sizes, results.names
+        if codes is None and not sized and not text:
+            selected = array('L', driver)
+        else:
+            selected = array('L')
+            for index in driver:
+                if codes is not None and type_codes[index] not in codes:
+                    continue
+                if sized and not min_size <= sizes[index] <= max_size:
+                    continue
+                if text and text not in names[index].lower():
+                    continue
+                selected.append(index)
+
+        if sort == 'size' and not size_ordered:
+            selected = self._ordered(selected, self.size_order, sizes.__getitem__)
+        elif sort == 'name':
+            selected = self._ordered(selected, self.name_order, lambda index: names[index].lower())
+        elif sort == 'path':
+            selected = self._ordered(selected, self.path_order, self.path_key)
+        elif sort is None and not scan_ordered:
+            selected = array('L', sorted(selected))
+        if descending:
+            selected.reverse()
+        return selected
+
+    @staticmethod
+    def _ordered(selected, order, key):
+        """按 order 的顺序排列 selected，结果较多时按掩码遍历预先排好的顺序，不再重新排序"""
+        if len(selected) * 16 < len(order):
+            return array('L', sorted(selected, key=key))
+        mask = bytearray(len(order))
+        for index in selected:
+            mask[index] = 1
+        return array('L', [index for index in order if mask[index]])
+
+    def total_size(self, indexes):
+        """返回文件的总字节数，大小未知的文件不计"""
+        sizes = self.results.sizes
+        return sum(max(sizes[index], 0) for index in indexes)
+
+
+class FileClassifier:
+    """扫描开始时一次性编译的文件分类器
+
+    根据界面选项生成不可变的 扩展名 -> 文件类型 查找表，需要跳过的扩展名映射为 None，
+    每个文件只需一次字典查找，扫描线程中不再访问任何 Tk 变量。
+    另外支持文件大小范围、修改时间范围和文件名通配符规则。
+    """
+
+    CUSTOM_TYPE = '临时类型'
+
+    def __init__(self, file_types, custom_extensions=(), skip_extensions=(), skip_names=(),
+                 min_size=None, max_size=None, min_mtime=None, max_mtime=None, name_patterns=()):
+        """编译分类表
+
+        file_types 为用户选中的 {文件类型: [扩展名, ...]}，custom_extensions 归为临时类型，
+        skip_extensions 和 skip_names 中的文件一律跳过。
+        """
+        table = {}
+        for file_type, extensions in file_types.items():
+            for ext in extensions:
+                table.setdefault(ext.lower(), file_type)
+        for ext in custom_extensions:
+            table[ext.lower()] = self.CUSTOM_TYPE
+        for ext in skip_extensions:
+            table[ext.lower()] = None
+        self.table = MappingProxyType(table)
+        self.skip_names = frozenset(name.lower() for name in skip_names)
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_mtime = min_mtime
+        self.max_mtime = max_mtime
+        self.has_stat_rules = any(v is not None for v in (min_size, max_size, min_mtime, max_mtime))
+
+        # 所有通配符合并成一个正则表达式
+        patterns = [fnmatch.translate(p) for p in name_patterns if p]
+        self.name_regex = re.compile('|'.join(patterns), re.IGNORECASE) if patterns else None
+
+    def is_skipped(self, filename):
+        """检查文件名是否属于始终跳过的隐藏文件、系统文件、代码文件或程序文件"""
+        if filename.startswith('.') or filename.lower() in self.skip_names:
+            return True
+        ext = os.path.splitext(filename)[1].lower()
+        return ext in self.table and self.table[ext] is None
+
+    def classify(self, filename):
+        """返回文件类型，不符合条件的文件返回 None"""
+        if filename.startswith('.'):
+            return None
+        file_type = self.table.get(os.path.splitext(filename)[1].lower())
+        if file_type is None or filename.lower() in self.skip_names:
+            return None
+        if self.name_regex is not None and not self.name_regex.match(filename):
+            return None
+        return file_type
+
+    def accepts(self, size, mtime):
+        """检查文件大小和修改时间是否在指定范围内"""
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        if self.min_mtime is not None and mtime < self.min_mtime:
+            return False
+        if self.max_mtime is not None and mtime > self.max_mtime:
+            return False
+        return True
+
+
+class DirPruner:
+    """预编译的目录名剪枝匹配器
+
+    精确名称使用集合查找，子串和通配符规则分别合并成一个正则表达式，
+    每个目录名只需一次集合查找和至多两次正则匹配。名称比较不区分大小写。
+    """
+
+    def __init__(self, names=(), substrings=(), patterns=()):
+        self.names = frozenset(name.lower() for name in names)
+        self.substring_regex = (re.compile('|'.join(re.escape(s) for s in substrings), re.IGNORECASE)
+                                if substrings else None)
+        self.pattern_regex = (re.compile('|'.join(fnmatch.translate(p) for p in patterns), re.IGNORECASE)
+                              if patterns else None)
+
+    def __call__(self, dirname):
+        """目录名命中任一规则时返回 True"""
+        if dirname.lower() in self.names:
+            return True
+        if self.substring_regex is not None and self.substring_regex.search(dirname):
+            return True
+        return self.pattern_regex is not None and self.pattern_regex.match(dirname) is not None
+
+
+def translate_ignore_pattern(pattern):
+    """把一条 .gitignore 风格的规则翻译成匹配相对路径的正则表达式"""
+    # 规则中间含有 / 时相对于忽略文件所在目录锚定，否则可以匹配任意层级
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**', i):
+                i += 2
+                if i < n and pattern[i] == '/':
+                    out.append('(?:.*/)?')
+                    i += 1
+                else:
+                    out.append('.*')
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = pattern.find(']', i + 2)
+            if j == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j].replace('\\', '\\\\')
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    prefix = '' if anchored else '(?:.*/)?'
+    return prefix + ''.join(out) + '$'
+
+
+class IgnoreRules:
+    """源目录树中 .gitignore 风格忽略文件的编译结果
+
+    规则相对于忽略文件所在目录匹配；没有取反规则时所有规则合并为一个正则表达式。
+    无法编译的规则（如 [z-a]）通过 log 报告后跳过。
+    """
+
+    FLAGS = re.IGNORECASE if os.name == 'nt' else 0
+
+    def __init__(self, base_dir, lines, log=None):
+        self.base_dir = base_dir
+        self.rules = []
+        for line in lines:
+            line = line.rstrip('\r\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            try:
+                regex = re.compile(translate_ignore_pattern(line), self.FLAGS)
+            except re.error as e:
+                if log is not None:
+                    log(f"忽略文件中的规则无效，已跳过: {base_dir} - {line} ({str(e)})")
+                continue
+            self.rules.append((negate, dir_only, regex))
+
+        self.has_negation = any(negate for negate, _, _ in self.rules)
+        if not self.has_negation:
+            dir_rules = [regex.pattern for _, _, regex in self.rules]
+            file_rules = [regex.pattern for _, dir_only, regex in self.rules if not dir_only]
+            self.dir_regex = re.compile('|'.join(dir_rules), self.FLAGS) if dir_rules else None
+            self.file_regex = re.compile('|'.join(file_rules), self.FLAGS) if file_rules else None
+
+    @classmethod
+    def from_file(cls, path, log=None):
+        """读取忽略文件"""
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return cls(os.path.dirname(path), f.readlines(), log)
+
+    def match(self, path, is_dir):
+        """返回 True 表示忽略，False 表示被取反规则重新包含，None 表示没有规则命中"""
+        relative = path[len(self.base_dir):].lstrip(os.sep)
+        if os.sep != '/':
+            relative = relative.replace(os.sep, '/')
+        if not self.has_negation:
+            regex = self.dir_regex if is_dir else self.file_regex
+            return True if regex is not None and regex.match(relative) else None
+        # 后出现的规则优先
+        for negate, dir_only, regex in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relative):
+                return not negate
+        return None
+
+
+def is_ignored(rules, path, is_dir):
+    """按从深到浅的顺序应用各层忽略规则"""
+    for ignore_rules in reversed(rules):
+        result = ignore_rules.match(path, is_dir)
+        if result is not None:
+            return result
+    return False
+
+
+class ScanIndex:
+    """持久化的增量扫描索引（SQLite）
+
+    记录每个目录的修改时间、子目录名，以及目录中每个文件的名称、大小和修改时间。
+    目录修改时间未变时直接返回上次的列举结果，文件类型在读取时由分类器重新判定，
+    因此修改扫描选项后索引仍然有效。可以被多个扫描线程同时使用。
+    """
+
+    SCHEMA_VERSION = 1
+    FLUSH_ROWS = 5000
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self._writer = self._connect()
+        if self._writer.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            self._writer.executescript("""
+                DROP TABLE IF EXISTS dirs;
+                DROP TABLE IF EXISTS files;
+            """)
+        self._writer.executescript(f"""
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                subdirs TEXT NOT NULL,
+                has_ignore INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER,
+                mtime REAL,
+                PRIMARY KEY (dir, name)
+            ) WITHOUT ROWID;
+            PRAGMA user_version = {self.SCHEMA_VERSION};
+        """)
+        self._writer.commit()
+
+        # 目录表整体载入内存，文件只在命中时按目录读取
+        self._dirs = {path: (mtime_ns, subdirs, has_ignore) for path, mtime_ns, subdirs, has_ignore
+                      in self._writer.execute("SELECT path, mtime_ns, subdirs, has_ignore FROM dirs")}
+        self._local = threading.local()
+        self._readers = []
+        self._pending_dirs = []
+        self._pending_files = []
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        """打开数据库连接"""
+        import sqlite3
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self):
+        """返回当前线程的只读连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._pending_lock:
+                self._readers.append(conn)
+        return conn
+
+    def lookup(self, path, mtime_ns):
+        """目录修改时间与索引一致时返回 (文件列表, 子目录名列表, 是否有忽略文件)，否则返回 None"""
+        cached = self._dirs.get(path)
+        if cached is None or cached[0] != mtime_ns:
+            self.misses += 1
+            return None
+        self.hits += 1
+        files = self._reader().execute("SELECT name, size, mtime FROM files WHERE dir = ?", (path,)).fetchall()
+        # 文件名中不会出现 /，用它分隔子目录名
+        subdirs = cached[1].split('/') if cached[1] else []
+        return files, subdirs, bool(cached[2])
+
+    def store(self, path, mtime_ns, files, subdirs, has_ignore):
+        """记录一个目录的列举结果，积累到一定数量后批量写入"""
+        with self._pending_lock:
+            self._pending_dirs.append((path, mtime_ns, '/'.join(subdirs), int(has_ignore)))
+            self._pending_files.extend((path, name, size, mtime) for name, size, mtime in files)
+            should_flush = len(self._pending_files) + len(self._pending_dirs) >= self.FLUSH_ROWS
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """把积累的列举结果写入数据库"""
+        with self._pending_lock:
+            dirs, self._pending_dirs = self._pending_dirs, []
+            files, self._pending_files = self._pending_files, []
+        if not dirs:
+            return
+        with self._write_lock:
+            with self._writer:
+                self._writer.executemany("DELETE FROM files WHERE dir = ?", [(row[0],) for row in dirs])
+                self._writer.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)", dirs)
+                self._writer.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", files)
+
+    def finish(self, root, visited, completed):
+        """写入剩余结果；完整扫描结束后删除根目录下已不存在或不再访问的目录记录"""
+        self.flush()
+        if not completed:
+            return
+        prefix = root.rstrip(os.sep) + os.sep
+        stale = [(path,) for path in self._dirs
+                 if (path == root or path.startswith(prefix)) and path not in visited]
+        if stale:
+            with self._write_lock:
+                with self._writer:
+                    self._writer.executemany("DELETE FROM files WHERE dir = ?", stale)
+                    self._writer.executemany("DELETE FROM dirs WHERE path = ?", stale)
+
+    def close(self):
+        """关闭所有数据库连接"""
+        self.flush()
+        for conn in self._readers:
+            conn.close()
+        self._writer.close()
+
+
+class ParallelScanner:
+    """基于 os.scandir 的并行目录扫描器
+
+    目录由有界线程池并发列举，文件大小直接取自 DirEntry 自带的 stat 信息，
+    结果按 os.walk 自顶向下的顺序返回。
+    """
+
+    def __init__(self, should_skip_dir, classifier, is_running, exclude_dir=None, workers=None, log=None,
+                 on_files=None, ignore_file_name=None, index=None, keep_results=True, metrics=None,
+                 on_progress=None, profiler=None):
+        """初始化扫描器
+
+        classifier 为编译好的 FileClassifier；is_running() 返回 False 时扫描尽快停止；
+        on_files(dirpath, files) 在每个目录列举完成后由工作线程调用，用于实时推送结果；
+        目录中存在名为 ignore_file_name 的文件时，按 .gitignore 语法对该子树剪枝；
+        提供 index (ScanIndex) 时，修改时间未变的目录直接使用索引中的列举结果；
+        keep_results 为 False 时结果只通过 on_files 推送，scan() 不保留也不返回结果，内存占用有上限。
+        提供 metrics (Metrics) 时统计目录数、文件数和每个目录的列举耗时；on_progress() 在每个目录
+        完成后由工作线程调用；提供 profiler (ThreadProfiler) 时分析各工作线程。
+        """
+        self.should_skip_dir = should_skip_dir
+        self.classifier = classifier
+        self.is_running = is_running
+        self.exclude_dir = os.path.normcase(os.path.normpath(exclude_dir)) if exclude_dir else None
+        self.workers = workers or FileTransferEngine.SCAN_WORKERS
+        self.log = log or (lambda message: None)
+        self.on_files = on_files
+        self.ignore_file_name = ignore_file_name
+        self.index = index
+        self.keep_results = keep_results
+        self.metrics = metrics
+        self.on_progress = on_progress
+        self.profiler = profiler
+
+    def is_excluded(self, path):
+        """检查目录是否是需要排除的目标文件夹或其子目录"""
+        if not self.exclude_dir:
+            return False
+        path = os.path.normcase(os.path.normpath(path))
+        return path == self.exclude_dir or path.startswith(self.exclude_dir.rstrip(os.sep) + os.sep)
+
+    def scan(self, source_dir):
+        """扫描目录树，按目录逐个生成 (目录路径, [(文件名, 大小, 类型), ...])"""
+        return self.scan_roots([source_dir])
+
+    def scan_roots(self, roots):
+        """同时扫描多个互不包含的目录树，结果按 roots 的顺序、每棵树内按 os.walk 的先序顺序生成"""
+        roots = [root for root in roots if not self._skip_root(root)]
+        if not roots:
+            return
+
+        tree = {}
+        pending = queue.Queue()
+        for root in roots:
+            pending.put((root, ()))
+        worker = self.profiler.wrap(self._worker) if self.profiler else self._worker
+        threads = [threading.Thread(target=worker, args=(pending, tree), daemon=True)
+                   for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        pending.join()
+        for _ in threads:
+            pending.put(None)
+        for thread in threads:
+            thread.join()
+
+        if self.index is not None:
+            visited = set(tree)
+            for root in roots:
+                self.index.finish(root, visited, completed=self.is_running())
+
+        if not self.keep_results:
+            return
+
+        # 按 os.walk 的先序顺序输出各目录的结果，输出后即释放
+        stack = list(reversed(roots))
+        while stack:
+            dirpath = stack.pop()
+            files, subdirs = tree.pop(dirpath, ((), ()))
+            if files:
+                yield dirpath, files
+            stack.extend(reversed(subdirs))
+
+    def _skip_root(self, root):
+        if self.is_excluded(root):
+            self.log(f"跳过目标文件夹及其子目录: {root}")
+            return True
+        return False
+
+    def _worker(self, pending, tree):
+        """工作线程：不断取出目录并列举，子目录放回队列"""
+        while True:
+            item = pending.get()
+            if item is None:
+                pending.task_done()
+                return
+            path, rules = item
+            try:
+                if self.is_running():
+                    started = time.perf_counter()
+                    files, subdirs, rules = self._scan_dir(path, rules)
+                    if self.metrics is not None:
+                        self.metrics.observe('scan_dir', time.perf_counter() - started)
+                        self.metrics.count('scan_dirs')
+                        self.metrics.count('scan_files', len(files))
+                    tree[path] = (files, subdirs) if self.keep_results else None
+                    if files and self.on_files:
+                        self.on_files(path, files)
+                    for subdir in subdirs:
+                        pending.put((subdir, rules))
+                    if self.on_progress:
+                        self.on_progress()
+            except OSError:
+                # 与 os.walk 一致，无法列举的目录直接忽略
+                pass
+            except Exception as e:
+                # 其他错误只跳过这个目录，工作线程继续运行，否则 pending.join() 会一直等待
+                self.log(f"扫描目录时发生错误，已跳过: {path} - {str(e)}")
+            finally:
+                pending.task_done()
+
+    def _list_dir(self, path):
+        """列举单个目录，返回 ([(文件名, 大小, 修改时间), ...], 子目录名列表, 是否有忽略文件)"""
+        if self.index is not None:
+            # 先取目录的修改时间再列举，列举期间发生的变化会在下次扫描时重新列举
+            dir_mtime_ns = os.stat(path).st_mtime_ns
+            cached = self.index.lookup(path, dir_mtime_ns)
+            if cached is not None:
+                return cached
+
+        files = []
+        subdirs = []
+        has_ignore = False
+        with os.scandir(path) as entries:
+            for entry in entries:
+                name = entry.name
+                if name == self.ignore_file_name:
+                    has_ignore = True
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                if is_dir:
+                    # 不跟随符号链接目录，与 os.walk 默认行为一致
+                    if not entry.is_symlink():
+                        subdirs.append(name)
+                    continue
+
+                # 建立索引时记录所有可能被选中的文件，否则只读取当前选中文件的 stat
+                if self.index is None:
+                    if self.classifier.classify(name) is None:
+                        continue
+                elif self.classifier.is_skipped(name):
+                    continue
+
+                # DirEntry 会缓存 stat 结果，Windows 上无需额外的系统调用
+                try:
+                    st = entry.stat()
+                    files.append((name, st.st_size, st.st_mtime))
+                except OSError:
+                    files.append((name, None, None))
+
+        if self.index is not None:
+            self.index.store(path, dir_mtime_ns, files, subdirs, has_ignore)
+        return files, subdirs, has_ignore
+
+    def _scan_dir(self, path, rules):
+        """扫描单个目录，返回 (文件结果, 子目录列表, 子目录适用的忽略规则)"""
+        started = time.perf_counter()
+        raw_files, subdir_names, has_ignore = self._list_dir(path)
+        if self.metrics is not None:
+            self.metrics.observe('scan_stat', time.perf_counter() - started)
+
+        # 先读取本目录的忽略文件，它对同级条目和整个子树生效
+        if has_ignore and self.ignore_file_name:
+            try:
+                rules = rules + (IgnoreRules.from_file(os.path.join(path, self.ignore_file_name), self.log),)
+            except OSError as e:
+                self.log(f"读取忽略文件失败: {path} - {str(e)}")
+
+        subdirs = []
+        for name in subdir_names:
+            if self.should_skip_dir(name):
+                continue
+            subdir = os.path.join(path, name)
+            if rules and is_ignored(rules, subdir, True):
+                continue
+            if self.is_excluded(subdir):
+                self.log(f"跳过目标文件夹及其子目录: {subdir}")
+                continue
+            subdirs.append(subdir)
+
+        files = []
+        classifier = self.classifier
+        for name, file_size, file_mtime in raw_files:
+            file_type = classifier.classify(name)
+            if file_type is None:
+                continue
+            if rules and is_ignored(rules, os.path.join(path, name), False):
+                continue
+            if classifier.has_stat_rules:
+                if file_size is None or not classifier.accepts(file_size, file_mtime):
+                    continue
+            files.append((name, file_size, file_type))
+        return files, subdirs, rules
+
+
+class SourceProfile:
+    """已知目录结构的源文件夹配置
+
+    源文件夹路径中包含 KEYWORDS 中任一关键字（不区分大小写）时适用。locate() 在 MAX_DEPTH 层以内
+    按广度优先查找名为 ROOT_NAMES 的目录（不区分大小写），只扫描这些目录。找到后不再深入，
+    同级的其他目录也不再列举。子类设置这些属性后加入 FileTransferEngine.SOURCE_PROFILES 即可支持新的结构。
+    """
+
+    NAME = ''
+    DESCRIPTION = ''
+    KEYWORDS = ()
+    ROOT_NAMES = ()
+    MAX_DEPTH = 4
+    MAX_DIRS = 10000  # 查找时最多列举的目录数
+
+    def matches(self, source_dir):
+        lowered = source_dir.lower()
+        return any(keyword in lowered for keyword in self.KEYWORDS)
+
+    def locate(self, source_dir, should_skip_dir=None, is_running=None):
+        """查找需要扫描的目录，返回 (目录列表, 这些目录的各级上级目录 -> 修改时间)"""
+        root_names = {name.lower() for name in self.ROOT_NAMES}
+        if os.path.basename(os.path.normpath(source_dir)).lower() in root_names:
+            return [source_dir], {}
+
+        found = []
+        mtimes = {}
+        level = [source_dir]
+        listed = 0
+        for depth in range(self.MAX_DEPTH):
+            next_level = []
+            for path in level:
+                if listed >= self.MAX_DIRS or (is_running is not None and not is_running()):
+                    return found, self._ancestor_mtimes(source_dir, found, mtimes)
+                try:
+                    mtimes[path] = os.stat(path).st_mtime_ns
+                    with os.scandir(path) as entries:
+                        children = sorted(entry.name for entry in entries
+                                          if entry.is_dir(follow_symlinks=False))
+                except OSError:
+                    continue
+                listed += 1
+
+                matched = [name for name in children if name.lower() in root_names]
+                found.extend(os.path.join(path, name) for name in matched)
+                if matched or depth + 1 >= self.MAX_DEPTH:
+                    continue
+                next_level.extend(os.path.join(path, name) for name in children
+                                  if not (should_skip_dir and should_skip_dir(name)))
+            level = next_level
+        return found, self._ancestor_mtimes(source_dir, found, mtimes)
+
+    @staticmethod
+    def _ancestor_mtimes(source_dir, found, mtimes):
+        """只保留找到的目录的各级上级目录，新增账号等变化会改变其中某个目录的修改时间"""
+        kept = {}
+        for root in found:
+            path = os.path.dirname(root)
+            while path in mtimes and path not in kept:
+                kept[path] = mtimes[path]
+                if path == source_dir:
+                    break
+                path = os.path.dirname(path)
+        return kept
+
+
+class WeChatProfile(SourceProfile):
+    """微信 PC 版数据目录：WeChat Files/<账号>/Msg 或 xwechat_files/<账号>/msg"""
+
+    NAME = 'wechat'
+    DESCRIPTION = '微信目录'
+    KEYWORDS = ('wechat', 'weixin')
+    ROOT_NAMES = ('msg',)
+
+
+class SourceProfileCache:
+    """记录各源文件夹中找到的扫描目录，上级目录的修改时间都没有变化时直接使用"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    @staticmethod
+    def _key(profile_name, source_dir):
+        return f"{profile_name}:{os.path.normcase(os.path.abspath(source_dir))}"
+
+    def lookup(self, profile_name, source_dir):
+        """返回缓存的目录列表，没有记录或已经变化时返回 None"""
+        entry = self._entries.get(self._key(profile_name, source_dir))
+        if not entry:
+            return None
+        try:
+            for path, mtime_ns in entry['mtimes'].items():
+                if os.stat(path).st_mtime_ns != mtime_ns:
+                    return None
+        except OSError:
+            return None
+        roots = entry['roots']
+        return roots if all(os.path.isdir(root) for root in roots) else None
+
+    def store(self, profile_name, source_dir, roots, mtimes):
+        """保存查找结果，无法写入时忽略"""
+        self._entries[self._key(profile_name, source_dir)] = {'roots': roots, 'mtimes': mtimes}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError:
+            pass
+
+
+class TransferCancelled(Exception):
+    """用户取消了转移操作"""
+
+
+def _partial_digest(path, size, chunk_size):
+    """计算文件开头和结尾各 chunk_size 字节的摘要，小文件直接读取全部内容"""
+    import hashlib
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(chunk_size))
+        if size > chunk_size:
+            f.seek(max(chunk_size, size - chunk_size))
+            digest.update(f.read(chunk_size))
+    return digest.digest()
+
+
+def _full_digest(path, is_running, chunk_size=1024 * 1024):
+    """计算整个文件的摘要"""
+    import hashlib
+    digest = hashlib.blake2b(digest_size=32)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            if not is_running():
+                raise TransferCancelled()
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.digest()
+
+
+def find_duplicates(candidates, is_running, workers=8, partial_size=64 * 1024):
+    """按内容查找重复文件
+
+    candidates 为 (编号, 路径, 大小) 序列，返回 {重复文件编号: 首次出现的文件编号}。
+    先按大小分组，大小相同的再比较开头和结尾的部分摘要，仍然相同且文件较大时才计算完整摘要，
+    大多数文件不会被完整读取。摘要由线程池并行计算，无法读取的文件视为不重复；
+    is_running() 返回 False 时，还没有比较完整摘要的大文件也视为不重复。
+    """
+    by_size = {}
+    for index, path, size in candidates:
+        if size is not None:
+            by_size.setdefault(size, []).append((index, path))
+    groups = [(size, members) for size, members in by_size.items() if len(members) > 1]
+
+    def regroup(executor, groups, digest_func):
+        # 在每个分组内按摘要再次分组，只保留仍有多个成员的分组
+        futures = [[(index, path, executor.submit(digest_func, path, size)) for index, path in members]
+                   for size, members in groups]
+        result = []
+        for (size, _), group_futures in zip(groups, futures):
+            by_digest = {}
+            for index, path, future in group_futures:
+                try:
+                    key = future.result()
+                except (OSError, TransferCancelled):
+                    continue
+                by_digest.setdefault(key, []).append((index, path))
+            result.extend((size, members) for members in by_digest.values() if len(members) > 1)
+        return result
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        groups = regroup(executor, groups, lambda path, size: _partial_digest(path, size, partial_size))
+        # 部分摘要已经覆盖了整个文件的小文件无需再完整读取
+        small = [group for group in groups if group[0] <= 2 * partial_size]
+        large = [group for group in groups if group[0] > 2 * partial_size]
+        if large and is_running():
+            large = regroup(executor, large, lambda path, size: _full_digest(path, is_running))
+        else:
+            # 只有开头和结尾相同的大文件不能确认重复，取消时丢弃
+            large = []
+
+    duplicates = {}
+    for _, members in small + large:
+        members.sort()
+        primary = members[0][0]
+        for index, _ in members[1:]:
+            duplicates[index] = primary
+    return duplicates
+
+
+def transfer_order(files, order):
+    """返回 ScanResults 中文件的转移顺序（编号列表），order 为 None 时按扫描顺序
+
+    'locality' 按目录路径排列，同一目录下的文件按 inode 编号排列（POSIX 上 inode 来自目录项，
+    不需要额外 stat），机械硬盘上读取位置更连续；'largest' 大文件优先，并发转移时最后不会只剩
+    一个大文件在复制；'smallest' 小文件优先，尽快完成大部分文件。大小未知的文件排在最后。
+    """
+    sizes = files.sizes
+    if order == 'largest':
+        return sorted(range(len(files)), key=lambda index: sizes[index], reverse=True)
+    if order == 'smallest':
+        return sorted(range(len(files)), key=lambda index: (sizes[index] < 0, sizes[index]))
+    if order != 'locality':
+        return range(len(files))
+    
+    by_dir = {}
+    for index, dir_code in enumerate(files.dir_codes):
+        by_dir.setdefault(dir_code, []).append(index)
+    result = []
+    for dir_code in sorted(by_dir, key=lambda code: files.dirs[code].split(os.sep)):
+        indexes = by_dir[dir_code]
+        if os.name == 'posix' and len(indexes) > 1:
+            try:
+                with os.scandir(files.dirs[dir_code]) as entries:
+                    inodes = {entry.name: entry.inode() for entry in entries}
+                indexes.sort(key=lambda index: inodes.get(files.names[index], 0))
+            except OSError:
+                pass
+        result.extend(indexes)
+    return result
+
+
+class NameIndex:
+    """目标文件夹的文件名分配索引
+
+    每个目标目录只列举一次，之后在内存中记录已使用的名称，以及每个基础名下一个可用的
+    序号，重名时按 "名称_N.扩展名" 的规则在常数时间内分配新名称。可以被多个线程同时使用。
+    """
+
+    def __init__(self):
+        self._used = {}  # 目标目录 -> 已使用的名称集合
+        self._next = {}  # (目标目录, 基础名, 扩展名) -> 下一个候选序号
+        self._lock = threading.Lock()
+
+    def _names(self, target_dir):
+        """返回目录中已使用的名称集合，首次访问时列举目录"""
+        names = self._used.get(target_dir)
+        if names is None:
+            try:
+                names = {os.path.normcase(name) for name in os.listdir(target_dir)}
+            except FileNotFoundError:
+                names = set()
+            self._used[target_dir] = names
+        return names
+
+    def reserve(self, target_dir, filename):
+        """为文件在目标目录中分配一个未使用的路径"""
+        with self._lock:
+            names = self._names(target_dir)
+            key = os.path.normcase(filename)
+            if key not in names:
+                names.add(key)
+                return os.path.join(target_dir, filename)
+
+            base, ext = os.path.splitext(filename)
+            counter_key = (target_dir, os.path.normcase(base), os.path.normcase(ext))
+            counter = self._next.get(counter_key, 1)
+            # 只会跳过目录中原本就存在的 名称_N 文件，均摊为常数时间
+            while os.path.normcase(f"{base}_{counter}{ext}") in names:
+                counter += 1
+            candidate = f"{base}_{counter}{ext}"
+            names.add(os.path.normcase(candidate))
+            self._next[counter_key] = counter + 1
+            return os.path.join(target_dir, candidate)
+
+    def claim(self, path):
+        """登记一个已经分配、但目标文件可能还不存在的路径"""
+        target_dir, filename = os.path.split(path)
+        with self._lock:
+            self._names(target_dir).add(os.path.normcase(filename))
+
+
+class TransferJournal:
+    """保存在备份文件夹中的追加写入式转移日志
+
+    依次记录任务设置 (start)、每个计划的操作 (plan)、计划完整 (planned)、开始执行 (begin)、
+    完成 (done) 或失败 (fail)，全部结束后记录 end。程序崩溃或用户停止后，可以据此只执行尚未完成的操作；
+    没有 planned 记录时计划只写了一部分，继续时需要重新扫描源文件夹补全计划。
+    """
+
+    FILE_NAME = '.transfer_journal.jsonl'
+    FSYNC_INTERVAL = 1.0  # 最多每隔多少秒把日志刷到磁盘
+
+    def __init__(self, backup_folder, first_id=0):
+        """打开日志，向已有日志追加新的计划时 first_id 为之前已经计划的操作数"""
+        self.backup_folder = backup_folder
+        self.path = os.path.join(backup_folder, self.FILE_NAME)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        self._next_id = first_id
+        self.complete = False
+
+    @classmethod
+    def exists(cls, backup_folder):
+        """检查备份文件夹中是否有转移日志"""
+        return os.path.isfile(os.path.join(backup_folder, cls.FILE_NAME))
+
+    def write(self, op, **fields):
+        """追加一条记录"""
+        fields['op'] = op
+        line = json.dumps(fields, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            now = time.monotonic()
+            if now - self._last_sync >= self.FSYNC_INTERVAL:
+                os.fsync(self._file.fileno())
+                self._last_sync = now
+
+    # 任务设置中的路径，与源文件路径一样保存为绝对路径，在其他工作目录中继续时仍然有效
+    PATH_SETTINGS = ('source', 'target', 'previous_backup')
+
+    def start(self, **settings):
+        """记录任务设置"""
+        for key in self.PATH_SETTINGS:
+            if settings.get(key):
+                settings[key] = os.path.abspath(settings[key])
+        self.write('start', **settings)
+
+    def plan(self, src, dst, size, link=None):
+        """记录一个计划的操作，src 保存为绝对路径，dst 和 link 保存为相对于备份文件夹的路径，返回操作编号"""
+        plan_id = self._next_id
+        self._next_id += 1
+        record = {'id': plan_id, 'src': os.path.abspath(src), 'dst': os.path.relpath(dst, self.backup_folder), 'size': size}
+        if link is not None:
+            record['link'] = os.path.relpath(link, self.backup_folder)
+        self.write('plan', **record)
+        return plan_id
+
+    def mark_complete(self):
+        """记录所有操作都已写入计划"""
+        self.write('planned')
+        self.complete = True
+
+    def close(self, finished=False):
+        """关闭日志，finished 为 True（没有停止也没有失败的文件）且计划完整时记录整个任务已结束"""
+        if finished and self.complete:
+            self.write('end')
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    @classmethod
+    def records(cls, backup_folder):
+        """逐条读取日志记录，忽略崩溃时写了一半的最后一行"""
+        with open(os.path.join(backup_folder, cls.FILE_NAME), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    @classmethod
+    def load_state(cls, backup_folder):
+        """返回 (任务设置, 已完成的操作编号集合, 计划操作数, 计划是否完整, 是否已结束)
+
+        只有记录了结束并且所有计划的操作都已完成才算已结束，失败的文件可以继续重试。
+        """
+        settings = {}
+        done = set()
+        planned = 0
+        complete = False
+        finished = False
+        for record in cls.records(backup_folder):
+            op = record.get('op')
+            if op == 'done':
+                done.add(record['id'])
+            elif op == 'plan':
+                # 监视模式在结束的批次之后继续追加计划
+                planned += 1
+                complete = False
+                finished = False
+            elif op == 'planned':
+                complete = True
+            elif op == 'start':
+                settings = record
+            elif op == 'end':
+                # 旧版本的日志没有 planned 记录，只在计划完整时才会记录结束
+                complete = True
+                finished = True
+        return settings, done, planned, complete, finished and len(done) >= planned
+
+    @classmethod
+    def planned_sources(cls, backup_folder):
+        """返回已经写入计划的源文件路径集合"""
+        return {record['src'] for record in cls.records(backup_folder) if record.get('op') == 'plan'}
+
+    @classmethod
+    def planned_targets(cls, backup_folder):
+        """逐个产出已经写入计划的目标路径（相对于备份文件夹）"""
+        for record in cls.records(backup_folder):
+            if record.get('op') == 'plan':
+                yield record['dst']
+
+    @classmethod
+    def pending_plans(cls, backup_folder, done, link):
+        """按计划顺序逐个产出尚未完成的操作，link 指定产出硬链接操作还是普通操作"""
+        for record in cls.records(backup_folder):
+            if record.get('op') == 'plan' and record['id'] not in done and ('link' in record) == link:
+                yield record
+
+    @classmethod
+    def pending_bytes(cls, backup_folder, done):
+        """返回尚未完成的操作的总字节数，大小未知的文件不计"""
+        return sum(max(record.get('size') or 0, 0) for record in cls.records(backup_folder)
+                   if record.get('op') == 'plan' and record['id'] not in done)
+
+
+# Linux 上用于创建 reflink 的 ioctl 请求码
+FICLONE = 0x40049409
+
+
+def _try_reflink(src_fd, dst_fd):
+    """尝试让目标文件与源文件共享数据块（Btrfs、XFS 等），成功返回 True"""
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError:
+        return False
+
+
+def copy_large_file(src, dst, on_bytes=None, is_running=None, chunk_size=8 * 1024 * 1024, hasher=None):
+    """分块复制大文件，支持字节级进度和中途取消
+
+    优先使用 reflink，其次是内核内复制的 os.copy_file_range 和 os.sendfile，
+    都不可用时退回到复用缓冲区的读写循环。每个分块完成后调用 on_bytes(字节数)；
+    is_running() 返回 False 时抛出 TransferCancelled。出错或取消时删除未完成的目标文件。
+    提供 hasher 时数据必须经过用户空间，只使用读写循环，并在同一个循环中更新摘要。
+    """
+    created = False
+    try:
+        with open(src, 'rb', buffering=0) as fsrc:
+            with open(dst, 'wb', buffering=0) as fdst:
+                created = True
+                src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+                if hasher is None and _try_reflink(src_fd, dst_fd):
+                    if on_bytes:
+                        on_bytes(os.fstat(src_fd).st_size)
+                else:
+                    _copy_chunks(src_fd, dst_fd, on_bytes, is_running, chunk_size, hasher)
+        import shutil
+        shutil.copystat(src, dst)
+    except BaseException:
+        if created:
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+        raise
+    return dst
+
+
+# 表示当前复制方式不受支持、可以换用下一种方式的错误码
+_UNSUPPORTED_COPY_ERRNOS = {
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP,
+    errno.ENOTSOCK, errno.EBADF,
+}
+
+
+def _copy_chunks(src_fd, dst_fd, on_bytes, is_running, chunk_size, hasher=None):
+    """依次尝试 copy_file_range、sendfile 和缓冲读写，逐块复制文件内容"""
+    if hasher is None:
+        methods = [name for name in ('copy_file_range', 'sendfile') if hasattr(os, name)]
+    else:
+        methods = []
+    buffer = None
+    copied = 0
+    while True:
+        if is_running is not None and not is_running():
+            raise TransferCancelled()
+
+        method = methods[0] if methods else None
+        try:
+            if method == 'copy_file_range':
+                n = os.copy_file_range(src_fd, dst_fd, chunk_size)
+            elif method == 'sendfile':
+                n = os.sendfile(dst_fd, src_fd, copied, chunk_size)
+            else:
+                if buffer is None:
+                    buffer = memoryview(bytearray(min(chunk_size, 1024 * 1024)))
+                    os.lseek(src_fd, copied, os.SEEK_SET)
+                n = os.readv(src_fd, [buffer]) if hasattr(os, 'readv') else _readinto(src_fd, buffer)
+                if hasher is not None:
+                    hasher.update(buffer[:n])
+                written = 0
+                while written < n:
+                    written += os.write(dst_fd, buffer[written:n])
+        except OSError as e:
+            # 文件系统或平台不支持时换下一种方式，从已复制的位置继续
+            if method is None or e.errno not in _UNSUPPORTED_COPY_ERRNOS:
+                raise
+            methods.pop(0)
+            os.lseek(dst_fd, copied, os.SEEK_SET)
+            continue
+
+        if n == 0:
+            break
+        copied += n
+        if on_bytes:
+            on_bytes(n)
+
+
+def file_digest(path, algorithm, is_running=None, chunk_size=1024 * 1024):
+    """计算整个文件的十六进制摘要"""
+    hasher = new_hasher(algorithm)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            if is_running is not None and not is_running():
+                raise TransferCancelled()
+            n = f.readinto(buffer)
+            if not n:
+                break
+            hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+def copy_verified(src, dst, algorithm, on_bytes=None, is_running=None):
+    """复制的同时计算源数据的摘要，复制后与目标文件的摘要核对，返回十六进制摘要
+
+    源文件只读取一次；不一致时删除目标文件并抛出 OSError。
+    """
+    hasher = new_hasher(algorithm)
+    copy_large_file(src, dst, on_bytes=on_bytes, is_running=is_running, hasher=hasher)
+    digest = hasher.hexdigest()
+    if file_digest(dst, algorithm, is_running) != digest:
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        raise OSError(f"校验失败: 目标文件内容与源文件不一致 ({algorithm})")
+    return digest
+
+
+class ChecksumManifest:
+    """备份文件夹中的校验清单，格式与 sha256sum 等工具相同，可以被多个线程同时写入"""
+
+    def __init__(self, backup_folder, algorithm):
+        self.backup_folder = backup_folder
+        self.path = os.path.join(backup_folder, f"checksums.{algorithm}")
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def add(self, digest, path):
+        """记录一个文件的摘要，路径保存为相对于备份文件夹的路径"""
+        relative = os.path.relpath(path, self.backup_folder).replace(os.sep, '/')
+        with self._lock:
+            self._file.write(f"{digest}  {relative}\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class SmallFileArchives:
+    """把小文件写入 tar 包而不是逐个创建文件，每个 tar 包带有记录成员位置的索引文件
+
+    tar 包保存在备份文件夹的 PACK_FOLDER 中，每个目标目录（按类型分类时即每个类型）一个，
+    超过 MAX_ARCHIVE_BYTES 时换下一个。成员名是文件相对于备份文件夹的路径，把 tar 包解压到
+    备份文件夹即可还原为普通文件。索引文件每行记录成员名、数据偏移和大小，读取单个文件时
+    直接定位，无需从头解析 tar 包。不同目录的 tar 包可以被多个线程同时写入。
+    """
+
+    PACK_FOLDER = '小文件打包'
+    INDEX_SUFFIX = '.index.jsonl'
+    MAX_ARCHIVE_BYTES = 2 * 1024 * 1024 * 1024
+
+    def __init__(self, backup_folder):
+        self.backup_folder = backup_folder
+        self.folder = os.path.join(backup_folder, self.PACK_FOLDER)
+        self._volumes = {}  # 目标目录 -> 当前 tar 包的状态
+        self._lock = threading.Lock()
+        self.packed = self.load_members(backup_folder)  # 已打包的成员名，继续任务时跳过
+
+    @classmethod
+    def load_members(cls, backup_folder):
+        """读取备份文件夹中所有索引文件，返回已打包的成员名集合"""
+        members = set()
+        folder = os.path.join(backup_folder, cls.PACK_FOLDER)
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            return members
+        for name in names:
+            if name.endswith(cls.INDEX_SUFFIX):
+                members.update(cls.read_index(os.path.join(folder, name[:-len(cls.INDEX_SUFFIX)])))
+        return members
+
+    @classmethod
+    def read_index(cls, archive_path):
+        """读取 tar 包的索引，返回 {成员名: 索引记录}"""
+        entries = {}
+        with open(archive_path + cls.INDEX_SUFFIX, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # 中断时写了一半的最后一行
+                entries[entry['name']] = entry
+        return entries
+
+    @classmethod
+    def extract(cls, archive_path, name, dst):
+        """根据索引直接读取 tar 包中的一个成员并写入 dst"""
+        entry = cls.read_index(archive_path)[name]
+        with open(archive_path, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fsrc.seek(entry['offset'])
+            remaining = entry['size']
+            while remaining:
+                chunk = fsrc.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    raise OSError(f"tar 包不完整: {archive_path}")
+                fdst.write(chunk)
+                remaining -= len(chunk)
+        os.utime(dst, (entry['mtime'], entry['mtime']))
+        return dst
+
+    def _volume(self, target_dir):
+        with self._lock:
+            volume = self._volumes.get(target_dir)
+            if volume is None:
+                volume = {'lock': threading.Lock(), 'tar': None, 'index': None, 'number': 0}
+                self._volumes[target_dir] = volume
+            return volume
+
+    def _open_next(self, target_dir, volume):
+        """关闭当前 tar 包并创建下一个，已存在的编号（之前中断的任务）不再写入"""
+        self._close_volume(volume)
+        label = os.path.relpath(target_dir, self.backup_folder)
+        label = '全部' if label == os.curdir else label.replace(os.sep, '_')
+        os.makedirs(self.folder, exist_ok=True)
+        while True:
+            volume['number'] += 1
+            path = os.path.join(self.folder, f"{label}_{volume['number']:03d}.tar")
+            if not os.path.exists(path):
+                break
+        import tarfile
+        volume['tar'] = tarfile.open(path, 'w', format=tarfile.PAX_FORMAT)
+        volume['index'] = open(path + self.INDEX_SUFFIX, 'w', encoding='utf-8')
+        return volume['tar']
+
+    @staticmethod
+    def _close_volume(volume):
+        if volume['tar'] is not None:
+            volume['tar'].close()
+            volume['index'].close()
+            volume['tar'] = volume['index'] = None
+
+    def add(self, src, target_path):
+        """把 src 写入 target_path 所在目录对应的 tar 包，成员名由 target_path 决定"""
+        import tarfile
+        name = os.path.relpath(target_path, self.backup_folder).replace(os.sep, '/')
+        volume = self._volume(os.path.dirname(target_path))
+        with open(src, 'rb') as f, volume['lock']:
+            tar = volume['tar']
+            if tar is None or tar.offset >= self.MAX_ARCHIVE_BYTES:
+                tar = self._open_next(os.path.dirname(target_path), volume)
+            info = tar.gettarinfo(arcname=name, fileobj=f)
+            info.uid = info.gid = 0
+            info.uname = info.gname = ''
+            header_offset = tar.offset
+            try:
+                tar.addfile(info, f)
+            except BaseException:
+                # 截掉写了一半的成员，后面的成员仍然紧接在上一个完整成员之后
+                tar.fileobj.seek(header_offset)
+                tar.fileobj.truncate()
+                tar.offset = header_offset
+                raise
+            # 不保留成员列表，内存占用与打包的文件数量无关
+            tar.members.clear()
+            tar.fileobj.flush()
+            blocks = (info.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+            data_offset = tar.offset - blocks * tarfile.BLOCKSIZE
+            entry = {'name': name, 'offset': data_offset, 'size': info.size, 'mtime': info.mtime}
+            volume['index'].write(json.dumps(entry, ensure_ascii=False) + '\n')
+            volume['index'].flush()
+        with self._lock:
+            self.packed.add(name)
+
+    def is_packed(self, target_path):
+        """检查 target_path 对应的文件是否已经打包"""
+        return os.path.relpath(target_path, self.backup_folder).replace(os.sep, '/') in self.packed
+
+    def close(self):
+        """写入所有 tar 包的结束标记"""
+        with self._lock:
+            volumes = list(self._volumes.values())
+        for volume in volumes:
+            with volume['lock']:
+                self._close_volume(volume)
+
+
+def _readinto(fd, buffer):
+    """没有 os.readv 的平台上读取到缓冲区"""
+    data = os.read(fd, len(buffer))
+    buffer[:len(data)] = data
+    return len(data)
+
+
+class Metrics:
+    """线程安全的计数器和耗时统计
+
+    count(name) 累加计数；observe(name, 秒) 累加总耗时并按 BUCKETS 记入延迟直方图；
+    start_phase/end_phase 记录扫描、转移等阶段的起止时间，用于计算速率。
+    可以导出为 JSON 或 Prometheus 文本格式。
+    """
+
+    # 直方图各桶的上界（秒）
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+               0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    # 速率: 名称 -> (计数器, 阶段, 除数)
+    RATES = {
+        'scan_dirs_per_second': ('scan_dirs', 'scan', 1),
+        'scan_files_per_second': ('scan_files', 'scan', 1),
+        'transfer_files_per_second': ('transfer_files', 'transfer', 1),
+        'transfer_mb_per_second': ('transfer_bytes', 'transfer', 1024 * 1024),
+    }
+
+    PROMETHEUS_PREFIX = 'file_transfer_'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timings = {}  # 名称 -> [次数, 总耗时, 各桶计数]
+        self.phases = {}  # 阶段 -> [开始时间, 结束时间或 None]
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        bucket = bisect.bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = [0, 0.0, [0] * (len(self.BUCKETS) + 1)]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2][bucket] += 1
+
+    def start_phase(self, name):
+        with self._lock:
+            self.phases[name] = [time.perf_counter(), None]
+
+    def end_phase(self, name):
+        with self._lock:
+            if name in self.phases:
+                self.phases[name][1] = time.perf_counter()
+
+    def elapsed(self, name):
+        """阶段已经进行的秒数，未开始时返回 0"""
+        phase = self.phases.get(name)
+        if phase is None:
+            return 0.0
+        return (phase[1] or time.perf_counter()) - phase[0]
+
+    def rate(self, name):
+        """按 RATES 中的定义计算速率，阶段未开始时返回 0"""
+        counter, phase, divisor = self.RATES[name]
+        elapsed = self.elapsed(phase)
+        return self.counters.get(counter, 0) / divisor / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        """返回所有统计值的字典"""
+        with self._lock:
+            counters = dict(self.counters)
+            timings = {name: {'count': count, 'sum_seconds': total,
+                              'buckets': dict(zip([str(b) for b in self.BUCKETS] + ['+Inf'], buckets))}
+                       for name, (count, total, buckets) in self.timings.items()}
+        return {
+            'counters': counters,
+            'timings': timings,
+            'phases': {name: round(self.elapsed(name), 6) for name in self.phases},
+            'rates': {name: round(self.rate(name), 3) for name in self.RATES},
+        }
+
+    def to_prometheus(self):
+        """导出为 Prometheus 文本格式"""
+        prefix = self.PROMETHEUS_PREFIX
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"# TYPE {prefix}{name}_total counter")
+            lines.append(f"{prefix}{name}_total {value}")
+        for name, timing in sorted(snapshot['timings'].items()):
+            metric = f"{prefix}{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in timing['buckets'].items():
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{metric}_sum {timing['sum_seconds']}")
+            lines.append(f"{metric}_count {timing['count']}")
+        lines.append(f"# TYPE {prefix}phase_seconds gauge")
+        for name, seconds in sorted(snapshot['phases'].items()):
+            lines.append(f'{prefix}phase_seconds{{phase="{name}"}} {seconds}')
+        for name, value in sorted(snapshot['rates'].items()):
+            lines.append(f"# TYPE {prefix}{name} gauge")
+            lines.append(f"{prefix}{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """写入统计文件，扩展名为 .prom 或 .txt 时使用 Prometheus 文本格式，否则为 JSON"""
+        if os.path.splitext(path)[1].lower() in ('.prom', '.txt'):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.snapshot(), ensure_ascii=False, indent=2) + '\n'
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+
+class AsyncLog:
+    """在后台线程中输出日志，调用线程只把消息放入队列，不等待输出完成
+
+    后台线程在第一条日志时启动，close() 输出剩余日志后结束线程，之后再记录日志会重新启动。
+    """
+
+    _STOP = object()
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def __call__(self, message):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._queue.put(message)
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            try:
+                if message is self._STOP:
+                    return
+                self.sink(message)
+            except Exception:
+                pass
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """等待已经放入队列的日志全部输出"""
+        self._queue.join()
+
+    def close(self):
+        """输出已经放入队列的日志并结束后台线程"""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(self._STOP)
+            self._thread = None
+        thread.join()
+
+
+class ThreadProfiler:
+    """cProfile 只能统计当前线程，这里为每个线程分别建立一个 Profile，保存时合并"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def wrap(self, func):
+        """返回在当前线程的 Profile 下执行 func 的函数，可以嵌套调用"""
+        def wrapper(*args, **kwargs):
+            local = self._local
+            if getattr(local, 'depth', 0):
+                return func(*args, **kwargs)
+            profile = getattr(local, 'profile', None)
+            if profile is None:
+                import cProfile
+                profile = local.profile = cProfile.Profile()
+                with self._lock:
+                    self._profiles.append(profile)
+            local.depth = 1
+            profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                local.depth = 0
+        return wrapper
+
+    def dump(self, path):
+        """合并所有线程的统计并保存，可以用 pstats 或 snakeviz 等工具查看"""
+        with self._lock:
+            profiles = list(self._profiles)
+        if profiles:
+            import pstats
+            pstats.Stats(*profiles).dump_stats(path)
+
+
+def throttle(interval, func):
+    """返回最多每 interval 秒真正调用一次 func 的函数，force=True 时总是调用"""
+    last_call = [0.0]
+
+    def call(*args, force=False):
+        now = time.monotonic()
+        if force or now - last_call[0] >= interval:
+            last_call[0] = now
+            func(*args)
+    return call
+
+
+class TransferEngine:
+    """并发文件转移引擎
+
+    文件由线程池并发转移，同一源设备、同一目标设备（按 st_dev 区分）上同时进行的操作数
+    分别受 per_device 限制。每个任务完成时立即回调一次（用于记录结果和进度），
+    另外按提交顺序再回调一次，便于按顺序输出日志。
+    """
+
+    def __init__(self, operation, is_running, workers=None, per_device=None):
+        """初始化引擎
+
+        operation(src, dst, *extra) 执行单个文件的转移；is_running() 返回 False 时停止提交新任务。
+        """
+        self.operation = operation
+        self.is_running = is_running
+        self.workers = workers or FileTransferEngine.TRANSFER_WORKERS
+        self.per_device = per_device or FileTransferEngine.PER_DEVICE_CONCURRENCY
+        self._dev_cache = {}
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def device_of(self, path):
+        """返回文件所在设备号，按所在目录缓存"""
+        dirname = os.path.dirname(path)
+        dev = self._dev_cache.get(dirname)
+        if dev is None:
+            try:
+                dev = os.stat(dirname).st_dev
+            except OSError:
+                dev = -1
+            self._dev_cache[dirname] = dev
+        return dev
+
+    def _limit(self, dev):
+        """返回设备对应的并发信号量"""
+        with self._lock:
+            semaphore = self._limits.get(dev)
+            if semaphore is None:
+                semaphore = self._limits[dev] = threading.BoundedSemaphore(self.per_device)
+            return semaphore
+
+    def _run_job(self, job, devices, on_complete):
+        """在工作线程中执行单个任务并回调 on_complete，返回异常或 None"""
+        error = self._execute(job, devices)
+        if on_complete is not None and not isinstance(error, TransferCancelled):
+            on_complete(job, error)
+        return error
+
+    def _execute(self, job, devices):
+        """执行单个任务，返回异常或 None"""
+        # 按设备号顺序获取信号量，避免互相等待
+        acquired = []
+        try:
+            for dev in devices:
+                semaphore = self._limit(dev)
+                semaphore.acquire()
+                acquired.append(semaphore)
+            if not self.is_running():
+                raise TransferCancelled()
+            self.operation(*job)
+            return None
+        except Exception as e:
+            return e
+        finally:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+
+    def run(self, jobs, on_done, on_complete=None):
+        """执行 jobs 中的 (src, dst, *extra) 任务
+
+        on_complete(job, error) 在任务完成时立即在工作线程中回调，可能被多个线程同时调用；
+        on_done(job, error) 按提交顺序在调用线程中回调。因取消而未执行的任务都不回调。
+        只限制尚未完成的任务数量，排在前面的大文件还在转移时，后面已完成的任务先缓存在窗口中，
+        等前面的任务完成后再按顺序回调 on_done，不会阻止提交新任务。
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        window = deque()  # 按提交顺序排列、尚未回调的任务
+        unfinished = set()
+        max_in_flight = self.workers * 4
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for job in jobs:
+                if not self.is_running():
+                    break
+                devices = sorted({self.device_of(job[0]), self.device_of(job[1])})
+                future = executor.submit(self._run_job, job, devices, on_complete)
+                window.append((job, future))
+                unfinished.add(future)
+                if len(unfinished) >= max_in_flight:
+                    _, unfinished = wait(unfinished, return_when=FIRST_COMPLETED)
+                while window and window[0][1].done():
+                    self._report(window.popleft(), on_done)
+
+            # 取消后尚未开始的任务直接放弃
+            if not self.is_running():
+                for _, future in window:
+                    future.cancel()
+            while window:
+                self._report(window.popleft(), on_done)
+
+    @staticmethod
+    def _report(item, on_done):
+        """回调单个已完成的任务"""
+        job, future = item
+        if future.cancelled():
+            return
+        error = future.result()
+        if not isinstance(error, TransferCancelled):
+            on_done(job, error)
+
+
+class SettleTracker:
+    """等待仍在写入的文件写完
+
+    每次收到文件的变化时重新计时，文件大小和修改时间连续 settle 秒不变才认为写入完成。
+    """
+
+    def __init__(self, settle):
+        self.settle = settle
+        self._pending = {}  # 路径 -> (大小, 修改时间纳秒, 最后一次变化的时间)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, path):
+        """记录文件发生了变化，文件已不存在时不再等待"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._pending.pop(path, None)
+            return
+        self._pending[path] = (st.st_size, st.st_mtime_ns, time.monotonic())
+
+    def timeout(self):
+        """距离最早一个文件可能写完的秒数，没有等待中的文件时返回 None"""
+        if not self._pending:
+            return None
+        earliest = min(changed for _, _, changed in self._pending.values())
+        return max(0.0, earliest + self.settle - time.monotonic())
+
+    def ready(self):
+        """返回已经写完的文件 [(路径, stat 结果), ...]，并停止等待它们"""
+        now = time.monotonic()
+        finished = []
+        for path, (size, mtime_ns, changed) in list(self._pending.items()):
+            if now - changed < self.settle:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                # 没有收到事件也在变化（轮询模式或网络共享上），重新计时
+                self._pending[path] = (st.st_size, st.st_mtime_ns, now)
+                continue
+            del self._pending[path]
+            finished.append((path, st))
+        return finished
+
+
+class DirectoryWatcher:
+    """监视多个目录树中新建、修改或移入的文件
+
+    Linux 上使用 inotify，每个目录一个监视，没有变化时阻塞在 select 上，几乎不占用 CPU；
+    其他平台或 inotify 不可用（如目录数超过 fs.inotify.max_user_watches）时每隔 poll_interval 秒
+    重新列举目录树，比较文件大小和修改时间。should_skip_dir 为 True 的目录和 exclude_dir 不监视，
+    只报告 accept_file(文件名) 为 True 的文件。与扫描时一样应用各层 ignore_file_name 忽略文件中的规则，
+    忽略文件被修改后重新读取。
+    """
+
+    # inotify 事件掩码
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+
+    # inotify_event 结构体头部: wd, mask, cookie, len
+    EVENT_HEADER_FORMAT = 'iIII'
+    READ_SIZE = 256 * 1024
+
+    def __init__(self, roots, should_skip_dir, accept_file=None, exclude_dir=None, poll_interval=5.0, log=None,
+                 ignore_file_name=None):
+        self.should_skip_dir = should_skip_dir
+        self.accept_file = accept_file or (lambda name: True)
+        self.exclude_dir = os.path.normcase(os.path.normpath(exclude_dir)) if exclude_dir else None
+        self.roots = [root for root in roots if not self.is_excluded(root)]
+        self.poll_interval = poll_interval
+        self.log = log or (lambda message: None)
+        self.ignore_file_name = ignore_file_name
+        self.backend = None
+        self._libc = None
+        self._fd = None
+        self._header = None
+        self._watches = {}  # 监视描述符 -> 目录路径
+        self._rules = {}  # inotify 模式下: 目录路径 -> 目录中的条目适用的忽略规则
+        self._snapshot = {}  # 轮询模式下: 路径 -> (大小, 修改时间纳秒)
+        self._next_poll = 0.0
+        self._started = None
+
+    def is_excluded(self, path):
+        """检查目录是否是需要排除的目标文件夹或其子目录"""
+        if not self.exclude_dir:
+            return False
+        path = os.path.normcase(os.path.normpath(path))
+        return path == self.exclude_dir or path.startswith(self.exclude_dir.rstrip(os.sep) + os.sep)
+
+    def start(self, use_inotify=True):
+        """建立监视，返回使用的方式 'inotify' 或 'poll'"""
+        self._started = time.time()
+        if use_inotify and self._start_inotify():
+            self.backend = 'inotify'
+        else:
+            self._snapshot = self._poll_snapshot()
+            self._next_poll = time.monotonic() + self.poll_interval
+            self.backend = 'poll'
+        return self.backend
+
+    @property
+    def watch_count(self):
+        """inotify 监视的目录数"""
+        return len(self._watches)
+
+    def wait(self, timeout):
+        """最多等待 timeout 秒，返回期间新建、修改或移入的文件路径集合"""
+        if self.backend == 'inotify':
+            return self._wait_inotify(timeout)
+        return self._wait_poll(timeout)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._watches.clear()
+        self._rules.clear()
+
+    def _load_rules(self, dirpath, rules, has_ignore):
+        """返回目录中的条目适用的忽略规则：上层的规则加上本目录忽略文件中的规则"""
+        if has_ignore:
+            try:
+                rules = rules + (IgnoreRules.from_file(os.path.join(dirpath, self.ignore_file_name), self.log),)
+            except OSError as e:
+                self.log(f"读取忽略文件失败: {dirpath} - {str(e)}")
+        if self._fd is not None:
+            self._rules[dirpath] = rules
+        return rules
+
+    def _walk(self, root, rules=()):
+        """按扫描时的剪枝和忽略规则列举目录树，产出 (目录路径, [符合条件的文件 DirEntry, ...])
+
+        rules 为 root 所在目录适用的忽略规则。
+        """
+        stack = [(root, rules)]
+        while stack:
+            dirpath, rules = stack.pop()
+            try:
+                with os.scandir(dirpath) as entries:
+                    entries = list(entries)
+            except OSError:
+                continue
+            has_ignore = bool(self.ignore_file_name) and any(entry.name == self.ignore_file_name for entry in entries)
+            rules = self._load_rules(dirpath, rules, has_ignore)
+            files = []
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    if self.accept_file(entry.name) and not (rules and is_ignored(rules, entry.path, False)):
+                        files.append(entry)
+                elif (not entry.is_symlink() and not self.should_skip_dir(entry.name)
+                      and not (rules and is_ignored(rules, entry.path, True))
+                      and not self.is_excluded(entry.path)):
+                    stack.append((entry.path, rules))
+            yield dirpath, files
+
+    def _start_inotify(self):
+        if not sys.platform.startswith('linux'):
+            return False
+        import ctypes
+        import ctypes.util
+        import struct
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return False
+        if fd < 0:
+            return False
+        self._libc = libc
+        self._fd = fd
+        self._header = struct.Struct(self.EVENT_HEADER_FORMAT)
+        try:
+            for root in self.roots:
+                for dirpath, _ in self._walk(root):
+                    self._add_watch(dirpath)
+        except OSError as e:
+            self.log(f"inotify 不可用，改为定期轮询: {str(e)}")
+            self.close()
+            return False
+        return True
+
+    def _add_watch(self, dirpath):
+        """监视单个目录；同一目录被移动后再次添加时返回相同的描述符，路径随之更新"""
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), self.WATCH_MASK)
+        if wd < 0:
+            import ctypes
+            error = ctypes.get_errno()
+            if error in (errno.ENOSPC, errno.ENOMEM):
+                raise OSError(error, "监视的目录数超过 fs.inotify.max_user_watches")
+            return  # 目录已被删除或无权访问
+        self._watches[wd] = dirpath
+
+    def _parent_rules(self, dirpath):
+        """返回目录本身适用的忽略规则，即上一级目录中的条目适用的规则"""
+        return self._rules.get(os.path.dirname(dirpath), ())
+
+    def _watch_tree(self, root, rules=()):
+        """监视新出现的目录树，返回其中已有的文件（可能在建立监视之前就已写入）"""
+        paths = []
+        for dirpath, files in self._walk(root, rules):
+            try:
+                self._add_watch(dirpath)
+            except OSError as e:
+                self.log(f"无法监视目录: {dirpath} - {str(e)}")
+            paths.extend(entry.path for entry in files)
+        return paths
+
+    def _recent_files(self):
+        """重新建立全部监视，返回开始监视之后修改过的文件"""
+        recent = []
+        for root in self.roots:
+            for path in self._watch_tree(root):
+                try:
+                    if os.stat(path).st_mtime >= self._started:
+                        recent.append(path)
+                except OSError:
+                    continue
+        return recent
+
+    def _wait_inotify(self, timeout):
+        import select
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self._fd, self.READ_SIZE)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        header = self._header
+        offset = 0
+        while offset + header.size <= len(data):
+            wd, mask, _, length = header.unpack_from(data, offset)
+            name = data[offset + header.size:offset + header.size + length].rstrip(b'\0')
+            offset += header.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                self.log("文件变化过多，事件队列溢出，重新查找最近修改的文件")
+                changed.update(self._recent_files())
+                continue
+            if mask & self.IN_IGNORED:
+                self._rules.pop(self._watches.pop(wd, None), None)
+                continue
+            dirpath = self._watches.get(wd)
+            if dirpath is None or not name:
+                continue
+            rules = self._rules.get(dirpath)
+            if rules is None:
+                continue  # 忽略文件修改后被忽略的目录
+            name = os.fsdecode(name)
+            path = os.path.join(dirpath, name)
+            if mask & self.IN_ISDIR:
+                # 新建或移入的目录
+                if (mask & (self.IN_CREATE | self.IN_MOVED_TO) and not self.should_skip_dir(name)
+                        and not (rules and is_ignored(rules, path, True)) and not self.is_excluded(path)):
+                    changed.update(self._watch_tree(path, rules))
+            elif name == self.ignore_file_name:
+                # 忽略文件变化后重新计算这棵子树的规则，不再忽略的目录开始监视，已有的文件不报告
+                prefix = dirpath.rstrip(os.sep) + os.sep
+                for subdir in [subdir for subdir in self._rules if subdir == dirpath or subdir.startswith(prefix)]:
+                    del self._rules[subdir]
+                self._watch_tree(dirpath, self._parent_rules(dirpath))
+            elif self.accept_file(name) and not (rules and is_ignored(rules, path, False)):
+                changed.add(path)
+        return changed
+
+    def _poll_snapshot(self):
+        """列举所有符合条件的文件，返回 {路径: (大小, 修改时间纳秒)}"""
+        snapshot = {}
+        for root in self.roots:
+            for _, files in self._walk(root):
+                for entry in files:
+                    # DirEntry 会缓存 stat 结果，Windows 上无需额外的系统调用
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    snapshot[entry.path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def _wait_poll(self, timeout):
+        delay = self._next_poll - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return set()
+        if delay > 0:
+            time.sleep(delay)
+        snapshot = self._poll_snapshot()
+        changed = {path for path, state in snapshot.items() if self._snapshot.get(path) != state}
+        self._snapshot = snapshot
+        self._next_poll = time.monotonic() + self.poll_interval
+        return changed
+
+
+class FileTransferEngine:
+    """不依赖图形界面的扫描和转移引擎
+
+    选项在创建时传入，日志、状态和进度通过回调报告，未提供回调时日志输出到控制台。
+    扫描结果保存在 scanned_files 中；stop() 可以在任意线程中调用，正在进行的扫描或转移会尽快停止。
+    """
+    
+    # 定义常用文件类型
+    FILE_TYPES = {
+        '图片': ['.jpg', '.jpeg', '.png', '.gif'],
+        '音乐': ['.mp3'],
+        '视频': ['.mp4'],
+        '文档': ['.pdf', '.doc', '.docx', '.txt'],
+        '表格': ['.xls', '.xlsx', '.csv'],
+        '演示': ['.ppt', '.pptx'],
+        '压缩': ['.zip', '.rar', '.7z'],
+        
+    }
+    
+    # 程序类文件扩展名，需要跳过
+    PROGRAM_FILE_EXTENSIONS = [
+        '.exe', '.msi', '.dmg', '.pkg', '.deb', '.rpm', '.apk', '.app', '.command',
+        '.appimage', '.snap', '.flatpak', '.bin', '.run', '.out', '.jar', '.war'
+    ]
+    
+    # 代码格式文件扩展名，需要跳过
+    CODE_FILE_EXTENSIONS = [
+        '.py', '.js', '.html', '.css', '.java', '.cpp', '.c', '.h', '.cs', '.php',
+        '.rb', '.go', '.rs', '.swift', '.kt', '.scala', '.r', '.m', '.sh', '.bat',
+        '.ps1', '.sql', '.xml', '.json', '.yaml', '.yml', '.toml', '.ini', '.cfg',
+        '.conf', '.log', '.md', '.tex', '.less', '.sass', '.scss', '.vue', '.jsx',
+        '.tsx', '.ts', '.dart', '.lua', '.pl', '.vb', '.asm', '.s', '.dockerfile'
+    ]
+    
+    # 系统文件名，需要跳过
+    SKIP_FILE_NAMES = ['thumbs.db', 'desktop.ini', 'ds_store']
+    
+    # 系统和缓存文件目录，需要跳过（按目录名精确匹配，不区分大小写）
+    SKIP_DIRS = [
+        '$Recycle.Bin', 'System Volume Information', 'RECYCLER',
+        'Windows', 'Program Files', 'Program Files (x86)', 'ProgramData',
+        'AppData', 'Temp', 'tmp', 'cache', 'Cache', '.cache',
+        '__pycache__', 'node_modules', '.git', '.svn'
+    ]
+    
+    # 按子串匹配需要跳过的目录名
+    SKIP_DIR_SUBSTRINGS = []
+    
+    # 按通配符匹配需要跳过的目录名
+    SKIP_DIR_PATTERNS = ['Windows.old*', '*.tmp']
+    
+    # 预编译的目录剪枝匹配器
+    DIR_PRUNER = DirPruner(SKIP_DIRS, SKIP_DIR_SUBSTRINGS, SKIP_DIR_PATTERNS)
+    
+    # 源目录树中的忽略文件名，语法与 .gitignore 相同
+    IGNORE_FILE_NAME = '.transferignore'
+    
+    # 增量扫描索引文件位置
+    SCAN_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.file_transfer_tool', 'scan_index.sqlite3')
+    
+    # 已知目录结构的源文件夹配置，以及查找结果的缓存文件位置
+    SOURCE_PROFILES = [WeChatProfile()]
+    SOURCE_PROFILE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.file_transfer_tool', 'source_profiles.json')
+    
+    # 并行扫描线程数，网络共享和慢速磁盘上更多的并发可以掩盖延迟
+    SCAN_WORKERS = max(4, min(32, (os.cpu_count() or 1) * 4))
+    
+    # 超过该大小的文件分块复制，显示文件内进度并支持中途取消
+    LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+    
+    # 小文件打包模式下，小于该大小的文件写入 tar 包
+    PACK_FILE_THRESHOLD = 1024 * 1024
+    
+    # 备份文件夹名称格式
+    BACKUP_FOLDER_PATTERN = re.compile(r'^备份_\d{8}_\d{6}$')
+    
+    # 重复文件处理方式
+    DUPLICATE_MODES = {
+        '不处理': None,
+        '跳过重复文件': 'skip',
+        '硬链接到首个文件': 'link',
+        '仅生成报告': 'report',
+    }
+    
+    # 转移顺序
+    TRANSFER_ORDERS = {
+        '扫描顺序': None,
+        '按目录位置': 'locality',
+        '大文件优先': 'largest',
+        '小文件优先': 'smallest',
+    }
+    
+    # 重复文件报告文件名
+    DUPLICATE_REPORT_NAME = '重复文件报告.csv'
+    
+    # 流式转移时扫描线程与转移线程之间最多缓冲的目录批次数
+    STREAM_QUEUE_DIRS = 64
+    
+    # 并发转移线程数，以及默认的每设备并发上限
+    TRANSFER_WORKERS = 16
+    PER_DEVICE_CONCURRENCY = 4
+    
+    # 监视模式下文件大小和修改时间连续多少秒不变才认为写入完成，以及不能使用 inotify 时的轮询间隔（秒）
+    WATCH_SETTLE_SECONDS = 2.0
+    WATCH_POLL_INTERVAL = 5.0
+    
+    def __init__(self, target='', organize_by_type=True, file_types=None, custom_extensions=(),
+                 min_size=None, max_size=None, min_mtime=None, max_mtime=None, name_patterns=(),
+                 duplicate_mode=None, incremental_backup=False, per_device_limit=None, checksum=None,
+                 pack_small_files=False, transfer_order=None, on_log=None, on_status=None, on_progress=None, on_scan_files=None,
+                 metrics_path=None, profile_path=None):
+        """创建引擎
+
+        file_types 为要扫描的类型名称（None 表示全部），duplicate_mode 为 DUPLICATE_MODES 中的取值，
+        checksum 为 HASH_ALGORITHMS 中的算法名（None 表示不校验），transfer_order 为 TRANSFER_ORDERS 中的取值。
+        回调 on_log(消息)、on_status(状态文字)、on_progress(百分比) 可能在工作线程中调用；
+        on_scan_files(dirpath, files) 在扫描时逐目录推送结果。
+        日志在后台线程中输出；扫描或转移结束时把统计写入 metrics_path（.prom 为 Prometheus 文本格式，
+        其他为 JSON），提供 profile_path 时用 cProfile 分析各线程并保存到该文件。
+        """
+        if duplicate_mode not in self.DUPLICATE_MODES.values():
+            raise ValueError(f"未知的重复文件处理方式: {duplicate_mode}")
+        if checksum is not None and checksum not in HASH_ALGORITHMS:
+            raise ValueError(f"不支持的校验算法: {checksum}")
+        if transfer_order not in self.TRANSFER_ORDERS.values():
+            raise ValueError(f"未知的转移顺序: {transfer_order}")
+        
+        self.target = target
+        self.organize_by_type = organize_by_type
+        self.file_types = file_types
+        self.custom_extensions = list(custom_extensions)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_mtime = min_mtime
+        self.max_mtime = max_mtime
+        self.name_patterns = list(name_patterns)
+        self.duplicate_mode = duplicate_mode
+        self.incremental_backup = incremental_backup
+        self.per_device_limit = per_device_limit or self.PER_DEVICE_CONCURRENCY
+        self.checksum = checksum
+        self.pack_small_files = pack_small_files
+        self.transfer_order = transfer_order
+        self.on_log = on_log
+        self.on_status = on_status
+        self.on_progress = on_progress
+        self.on_scan_files = on_scan_files
+        self.metrics_path = metrics_path
+        self.profile_path = profile_path
+        
+        self.metrics = Metrics()
+        self.profiler = ThreadProfiler() if profile_path else None
+        self._log = AsyncLog(on_log or self.print_log)
+        self.classifier = self.build_classifier()
+        self.scanned_files = ScanResults()
+        self.is_running = True
+    
+    def stop(self):
+        """停止正在进行的扫描或转移"""
+        self.is_running = False
+    
+    def log(self, message):
+        """输出日志，只放入队列，由后台线程输出"""
+        self._log(message)
+    
+    @staticmethod
+    def print_log(message):
+        """未提供 on_log 时把日志输出到控制台"""
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        print(f"[{timestamp}] {message}")
+    
+    def update_status(self, status):
+        """报告当前状态"""
+        if self.on_status is not None:
+            self.on_status(status)
+    
+    def update_progress(self, percent):
+        """报告转移进度（百分比）"""
+        if self.on_progress is not None:
+            self.on_progress(percent)
+    
+    def finish_run(self):
+        """输出剩余日志并结束日志线程，保存统计和性能分析结果"""
+        self._log.close()
+        if self.metrics_path:
+            try:
+                self.metrics.write(self.metrics_path)
+            except OSError as e:
+                self.print_log(f"保存统计失败: {str(e)}")
+        if self.profiler is not None:
+            self.profiler.dump(self.profile_path)
+    
+    def _instrumented(self, func, *args):
+        """执行扫描或转移，结束后调用 finish_run"""
+        if self.profiler is not None:
+            func = self.profiler.wrap(func)
+        try:
+            return func(*args)
+        finally:
+            self.finish_run()
+    
+    def describe_rates(self, phase):
+        """返回阶段速率的说明文字"""
+        metrics = self.metrics
+        if phase == 'scan':
+            return (f"{metrics.rate('scan_dirs_per_second'):.0f} 个目录/秒，"
+                    f"{metrics.rate('scan_files_per_second'):.0f} 个文件/秒")
+        return (f"{metrics.rate('transfer_files_per_second'):.1f} 个文件/秒，"
+                f"{metrics.rate('transfer_mb_per_second'):.1f} MB/秒")
+    
+    def transfer_files(self, source, target, mode, files=None):
+        """转移文件，返回 (成功数, 失败数)
+
+        files 为 None 时转移 scanned_files；也可以传入逐个产出文件信息的迭代器（流式转移）。
+        """
+        return self._instrumented(self._transfer_files, source, target, mode, files)
+    
+    def _transfer_files(self, source, target, mode, files):
+        try:
+            organize = self.organize_by_type
+            
+            # 创建带时间戳的备份文件夹
+            current_time = time.strftime("%Y%m%d_%H%M%S")
+            backup_folder = os.path.join(target, f"备份_{current_time}")
+            os.makedirs(backup_folder, exist_ok=True)
+            
+            self.log(f"已创建备份文件夹: {backup_folder}")
+            
+            # 获取已扫描的文件列表
+            if files is None:
+                files = self.scanned_files
+                total = len(files)
+                if not files:
+                    self.log("没有找到符合条件的文件")
+                    self.update_status("没有找到符合条件的文件")
+                    return 0, 0
+                
+                self.log(f"找到 {total} 个文件")
+                self.update_status(f"找到 {total} 个文件，准备转移...")
+            else:
+                total = None
+                self.log("边扫描边转移")
+                self.update_status("正在扫描并转移...")
+            
+            # 查找重复文件，需要完整的扫描结果，流式转移时跳过
+            dedup_mode = self.duplicate_mode
+            duplicates = {}
+            if dedup_mode and total:
+                self.update_status("正在查找重复文件...")
+                candidates = ((index, file_info['path'], file_info['size']) for index, file_info in enumerate(files))
+                duplicates = find_duplicates(candidates, lambda: self.is_running)
+                self.log(f"找到 {len(duplicates)} 个重复文件")
+                if dedup_mode == 'skip':
+                    total -= len(duplicates)
+            elif dedup_mode:
+                self.log("边扫描边转移时不处理重复文件")
+            
+            # 增量备份：未变化的文件硬链接到上一次的备份文件夹
+            previous_backup = None
+            if self.incremental_backup:
+                if mode == "copy":
+                    previous_backup = self.find_previous_backup(target, backup_folder)
+                    if previous_backup:
+                        self.log(f"增量备份，参照上一次备份: {previous_backup}")
+                    else:
+                        self.log("没有找到上一次的备份文件夹，将完整复制")
+                else:
+                    self.log("移动模式不使用增量备份")
+            
+            # 校验复制结果
+            checksum = self.checksum
+            if checksum:
+                self.log(f"复制时校验文件内容，算法: {checksum}")
+            
+            # 所有操作先记录到转移日志中，中断后可以继续
+            journal = TransferJournal(backup_folder)
+            pack = self.pack_small_files
+            if pack:
+                self.log(f"小文件打包: 小于 {self.format_size(self.PACK_FILE_THRESHOLD)} 的文件写入 tar 包")
+            journal.start(source=source, target=target, mode=mode, previous_backup=previous_backup,
+                          checksum=checksum, pack=pack, organize=organize, filters=self.scan_filters())
+            
+            # 目标文件名在分配时即登记，避免并发任务使用同一个名称
+            name_index = NameIndex()
+            type_folders = set()
+            
+            # 硬链接模式下记录首个文件的目标路径
+            primary_targets = {}
+            primary_indexes = set(duplicates.values()) if dedup_mode == 'link' else set()
+            
+            # 转移顺序，流式转移时只能按扫描顺序
+            order = self.transfer_order
+            ordered = None
+            if order and total is None:
+                self.log("边扫描边转移时按扫描顺序转移")
+            elif order:
+                self.update_status("正在安排转移顺序...")
+                ordered = transfer_order(files, order)
+                label = next(label for label, value in self.TRANSFER_ORDERS.items() if value == order)
+                self.log(f"转移顺序: {label}")
+            planned_bytes = 0
+            
+            def plan_file(index, file_info):
+                nonlocal planned_bytes
+                file_path = file_info['path']
+                filename = os.path.basename(file_path)
+                
+                # 确定目标路径，分类文件夹在第一次用到时创建
+                if organize:
+                    target_dir = os.path.join(backup_folder, file_info['type'])
+                    if target_dir not in type_folders:
+                        os.makedirs(target_dir, exist_ok=True)
+                        type_folders.add(target_dir)
+                else:
+                    target_dir = backup_folder
+                
+                # 如果目标文件已存在，添加序号
+                started = time.perf_counter()
+                target_path = name_index.reserve(target_dir, filename)
+                self.metrics.observe('name_reserve', time.perf_counter() - started)
+                is_duplicate = index in duplicates and dedup_mode == 'link'
+                link = primary_targets.get(duplicates[index]) if is_duplicate else None
+                if index in primary_indexes:
+                    primary_targets[index] = target_path
+                plan_id = journal.plan(file_path, target_path, file_info['size'], link)
+                planned_bytes += max(file_info['size'] or 0, 0)
+                return {'id': plan_id, 'src': file_path, 'dst': target_path,
+                        'size': file_info['size'], 'link': link}
+            
+            def plans():
+                if ordered is None:
+                    numbered = enumerate(files)
+                else:
+                    numbered = ((index, files[index]) for index in ordered)
+                # 首个文件排在重复文件之后时，重复文件等其他文件都计划完再计划
+                deferred = []
+                for index, file_info in numbered:
+                    if index in duplicates and dedup_mode == 'skip':
+                        continue
+                    if index in duplicates and dedup_mode == 'link' and duplicates[index] not in primary_targets:
+                        deferred.append((index, file_info))
+                        continue
+                    yield plan_file(index, file_info)
+                for index, file_info in deferred:
+                    yield plan_file(index, file_info)
+                # 停止时扫描或计划只进行了一部分，不记录计划完整，继续时重新扫描补全
+                if self.is_running:
+                    journal.mark_complete()
+            
+            if total is None:
+                # 流式转移时边计划边执行
+                plan_source = lambda link: () if link else plans()
+            else:
+                # 先把完整的计划写入日志，执行时再从日志中逐条读回，内存占用与文件数量无关
+                self.update_status("正在生成转移计划...")
+                for _ in plans():
+                    if not self.is_running:
+                        break
+                plan_source = lambda link: self.journal_plans(backup_folder, set(), link)
+            
+            success_count, fail_count = self.run_transfer_plan(journal, plan_source, source, target, backup_folder,
+                                                               mode, previous_backup, total, checksum=checksum,
+                                                               pack=pack,
+                                                               total_bytes=None if total is None else planned_bytes)
+            
+            if duplicates and self.is_running:
+                action = next(label for label, value in self.DUPLICATE_MODES.items() if value == dedup_mode)
+                self.write_duplicate_report(backup_folder, files, duplicates, action, name_index)
+            
+            # 完成
+            if self.is_running:
+                self.log(f"转移完成! 成功: {success_count}, 失败: {fail_count}")
+                self.update_status(f"转移完成! 成功: {success_count}, 失败: {fail_count}")
+                if fail_count:
+                    self.log("失败的文件可以使用\"继续未完成任务\"重试")
+            else:
+                self.log("转移已停止，可以使用\"继续未完成任务\"从中断处继续")
+                self.update_status("转移已停止")
+            return success_count, fail_count
+                
+        except Exception as e:
+            self.log(f"转移过程中发生错误: {str(e)}")
+            self.update_status(f"转移失败: {str(e)}")
+            raise
+    
+    def journal_plans(self, backup_folder, done, link):
+        """从转移日志中逐条读回尚未完成的操作，路径还原为绝对路径"""
+        for record in TransferJournal.pending_plans(backup_folder, done, link):
+            yield {
+                'id': record['id'],
+                'src': record['src'],
+                'dst': os.path.join(backup_folder, record['dst']),
+                'size': record['size'],
+                'link': os.path.join(backup_folder, record['link']) if 'link' in record else None,
+            }
+    
+    def resume_transfer(self, backup_folder):
+        """根据备份文件夹中的转移日志继续未完成的任务，已完成的文件不再访问，返回 (成功数, 失败数)"""
+        return self._instrumented(self._resume_transfer, backup_folder)
+    
+    def _resume_transfer(self, backup_folder):
+        try:
+            settings, done, planned, complete, finished = TransferJournal.load_state(backup_folder)
+            if finished:
+                self.log("该备份文件夹中的任务已经全部完成")
+                self.update_status("任务已经全部完成")
+                return 0, 0
+            
+            source = settings.get('source', '')
+            target = settings.get('target', os.path.dirname(backup_folder))
+            mode = settings.get('mode', 'copy')
+            journal = TransferJournal(backup_folder, first_id=planned)
+            if complete:
+                journal.complete = True
+            else:
+                planned += self.complete_journal_plan(journal, backup_folder, settings)
+                if not self.is_running:
+                    journal.close()
+                    self.log("转移已停止，计划尚未补全，可以再次继续")
+                    self.update_status("转移已停止")
+                    return 0, 0
+            
+            total = planned - len(done)
+            self.log(f"继续未完成的任务: {backup_folder}，已完成 {len(done)} 个，剩余 {total} 个")
+            
+            plan_source = lambda link: self.journal_plans(backup_folder, done, link)
+            success_count, fail_count = self.run_transfer_plan(
+                journal, plan_source, source, target, backup_folder, mode,
+                settings.get('previous_backup'), total, resuming=True, checksum=settings.get('checksum'),
+                pack=settings.get('pack', False), total_bytes=TransferJournal.pending_bytes(backup_folder, done))
+            
+            if self.is_running:
+                self.log(f"转移完成! 成功: {success_count}, 失败: {fail_count}")
+                self.update_status(f"转移完成! 成功: {success_count}, 失败: {fail_count}")
+            else:
+                self.log("转移已停止")
+                self.update_status("转移已停止")
+            return success_count, fail_count
+        except Exception as e:
+            self.log(f"继续任务时发生错误: {str(e)}")
+            self.update_status(f"转移失败: {str(e)}")
+            raise
+    
+    def complete_journal_plan(self, journal, backup_folder, settings):
+        """中断时计划只写了一部分：按原来的筛选条件重新扫描源文件夹，把尚未计划的文件追加到计划中
+
+        已经计划的文件（包括已完成的）不再计划，按扫描顺序转移，不处理重复文件。返回新计划的操作数。
+        """
+        source = settings.get('source', '')
+        if not os.path.isdir(source):
+            raise ValueError(f"转移计划不完整，且源文件夹不存在: {source}")
+        self.log("转移计划不完整，重新扫描源文件夹补全计划")
+        self.update_status("正在重新扫描源文件夹...")
+        if 'filters' in settings:
+            self.apply_scan_filters(settings['filters'])
+        self.target = settings.get('target', os.path.dirname(backup_folder))
+        organize = settings.get('organize', self.organize_by_type)
+        
+        # 已计划但尚未完成的目标文件还不存在，先登记它们的名称
+        name_index = NameIndex()
+        for dst in TransferJournal.planned_targets(backup_folder):
+            name_index.claim(os.path.join(backup_folder, dst))
+        planned_sources = TransferJournal.planned_sources(backup_folder)
+        
+        type_folders = set()
+        added = 0
+        for file_info in self.stream_files(source):
+            file_path = os.path.abspath(file_info['path'])
+            if file_path in planned_sources:
+                continue
+            if organize:
+                target_dir = os.path.join(backup_folder, file_info['type'])
+                if target_dir not in type_folders:
+                    os.makedirs(target_dir, exist_ok=True)
+                    type_folders.add(target_dir)
+            else:
+                target_dir = backup_folder
+            target_path = name_index.reserve(target_dir, os.path.basename(file_path))
+            journal.plan(file_path, target_path, file_info['size'])
+            added += 1
+        if self.is_running:
+            journal.mark_complete()
+            self.log(f"补全计划: 新增 {added} 个文件")
+        return added
+    
+    def watch_files(self, source, target, mode, settle=None, use_inotify=True):
+        """监视源文件夹，把新建、修改或移入且已经写完的文件转移到同一个备份文件夹，直到 stop()
+
+        开始监视之前已有的文件不转移。文件大小和修改时间连续 settle 秒（默认 WATCH_SETTLE_SECONDS）
+        不变才认为写入完成；use_inotify 为 False 时总是定期轮询。返回 (成功数, 失败数)。
+        """
+        return self._instrumented(self._watch_files, source, target, mode, settle, use_inotify)
+    
+    def _watch_files(self, source, target, mode, settle, use_inotify):
+        try:
+            if self.classifier is None:
+                self.classifier = self.build_classifier()
+            classifier = self.classifier
+            
+            current_time = time.strftime("%Y%m%d_%H%M%S")
+            backup_folder = os.path.join(target, f"备份_{current_time}")
+            os.makedirs(backup_folder, exist_ok=True)
+            self.log(f"已创建备份文件夹: {backup_folder}")
+            
+            previous_backup = None
+            if self.incremental_backup and mode == "copy":
+                previous_backup = self.find_previous_backup(target, backup_folder)
+                if previous_backup:
+                    self.log(f"增量备份，参照上一次备份: {previous_backup}")
+            checksum = self.checksum
+            if checksum:
+                self.log(f"复制时校验文件内容，算法: {checksum}")
+            # 每批只有少量文件，逐个转移
+            if self.pack_small_files:
+                self.log("监视模式不打包小文件")
+            if self.duplicate_mode:
+                self.log("监视模式不处理重复文件")
+            
+            watcher = DirectoryWatcher(
+                self.locate_scan_roots(source),
+                self.should_skip_dir,
+                accept_file=lambda name: classifier.classify(name) is not None,
+                exclude_dir=target,
+                poll_interval=self.WATCH_POLL_INTERVAL,
+                log=self.log,
+                ignore_file_name=self.IGNORE_FILE_NAME,
+            )
+            self.update_status("正在建立监视...")
+            if watcher.start(use_inotify) == 'inotify':
+                self.log(f"开始监视（inotify），共 {watcher.watch_count} 个目录")
+            else:
+                self.log(f"开始监视（每 {self.format_duration(self.WATCH_POLL_INTERVAL)}轮询一次）")
+            self.update_status("正在监视源文件夹...")
+            
+            settling = SettleTracker(self.WATCH_SETTLE_SECONDS if settle is None else settle)
+            name_index = NameIndex()
+            type_folders = set()
+            handled = {}  # 已转移的文件 -> (大小, 修改时间纳秒)，内容再次变化时重新转移
+            planned = 0
+            success_count = 0
+            fail_count = 0
+            try:
+                while self.is_running:
+                    # 没有等待写完的文件时每 0.5 秒醒来一次检查是否停止
+                    timeout = settling.timeout()
+                    for path in watcher.wait(0.5 if timeout is None else min(timeout, 0.5)):
+                        settling.touch(path)
+                    
+                    batch = []
+                    for path, st in settling.ready():
+                        state = (st.st_size, st.st_mtime_ns)
+                        if handled.get(path) == state:
+                            continue
+                        if classifier.has_stat_rules and not classifier.accepts(st.st_size, st.st_mtime):
+                            continue
+                        handled[path] = state
+                        batch.append((path, st.st_size))
+                    if not batch or not self.is_running:
+                        continue
+                    
+                    # 每批使用同一个转移日志，操作编号接着上一批
+                    journal = TransferJournal(backup_folder, first_id=planned)
+                    if not planned:
+                        journal.start(source=source, target=target, mode=mode, previous_backup=previous_backup,
+                                      checksum=checksum, pack=False, organize=self.organize_by_type,
+                                      filters=self.scan_filters())
+                    plans = []
+                    for file_path, file_size in batch:
+                        filename = os.path.basename(file_path)
+                        if self.organize_by_type:
+                            target_dir = os.path.join(backup_folder, classifier.classify(filename))
+                            if target_dir not in type_folders:
+                                os.makedirs(target_dir, exist_ok=True)
+                                type_folders.add(target_dir)
+                        else:
+                            target_dir = backup_folder
+                        target_path = name_index.reserve(target_dir, filename)
+                        plan_id = journal.plan(file_path, target_path, file_size)
+                        plans.append({'id': plan_id, 'src': file_path, 'dst': target_path,
+                                      'size': file_size, 'link': None})
+                    journal.mark_complete()
+                    planned += len(plans)
+                    
+                    self.log(f"发现 {len(plans)} 个新文件")
+                    batch_success, batch_fail = self.run_transfer_plan(
+                        journal, lambda link: () if link else plans, source, target, backup_folder, mode,
+                        previous_backup, len(plans), checksum=checksum,
+                        total_bytes=sum(file_size for _, file_size in batch))
+                    success_count += batch_success
+                    fail_count += batch_fail
+                    self.update_status(f"正在监视源文件夹... 已转移 {success_count} 个文件，失败 {fail_count} 个")
+            finally:
+                watcher.close()
+            
+            self.log(f"监视已停止，共转移成功: {success_count}, 失败: {fail_count}")
+            self.update_status(f"监视已停止，成功: {success_count}, 失败: {fail_count}")
+            return success_count, fail_count
+        except Exception as e:
+            self.log(f"监视过程中发生错误: {str(e)}")
+            self.update_status(f"监视失败: {str(e)}")
+            raise
+    
+    def run_transfer_plan(self, journal, plan_source, source, target, backup_folder, mode, previous_backup,
+                          total, resuming=False, checksum=None, pack=False, total_bytes=None):
+        """执行转移计划，返回 (成功数, 失败数)
+
+        plan_source(link) 产出普通操作（link 为 False）或重复文件的硬链接操作（link 为 True）。
+        每个操作的开始、完成和失败都会追加到转移日志中，全部完成时日志记录为已结束。
+        提供 checksum 时复制的文件在同一次读取中计算校验和，核对后写入校验清单。
+        pack 为 True 时小文件写入 tar 包（同一卷上的移动仍然直接重命名）。
+        提供 total_bytes 时按字节计算进度和剩余时间，大文件复制过程中的字节也计入进度。
+        """
+        per_device = max(1, self.per_device_limit)
+        
+        operation = "复制" if mode == "copy" else "移动"
+        linked_count = 0
+        linked_lock = threading.Lock()
+        
+        # 只比较一次源文件夹和备份文件夹所在的设备
+        same_volume = mode == "move" and self.is_same_device(source, backup_folder)
+        if checksum not in HASH_ALGORITHMS:
+            checksum = None
+        if mode == "move":
+            self.log(f"移动方式: {self.describe_move_strategy(same_volume, checksum)}")
+            self.update_status(f"移动方式: {self.describe_move_strategy(same_volume, checksum)}")
+        
+        manifest = ChecksumManifest(backup_folder, checksum) if checksum else None
+        packer = SmallFileArchives(backup_folder) if pack else None
+        metrics = self.metrics
+        
+        def copy_timed(copy_function, file_path, target_path, verify=False):
+            started = time.perf_counter()
+            self.copy_atomic(copy_function, file_path, target_path, verify)
+            metrics.observe('copy', time.perf_counter() - started)
+        
+        def pack_timed(file_path, target_path):
+            started = time.perf_counter()
+            packer.add(file_path, target_path)
+            metrics.observe('pack', time.perf_counter() - started)
+        
+        def operation_func(file_path, target_path, file_size, plan_id, link_target):
+            nonlocal linked_count
+            journal.write('begin', id=plan_id)
+            
+            # 中断前已经写入 tar 包、只是没来得及记录的文件
+            if resuming and packer is not None and packer.is_packed(target_path):
+                if mode == "move" and os.path.exists(file_path):
+                    os.unlink(file_path)
+                return
+            
+            # 中断前已经移动完成、只是没来得及记录的文件
+            if resuming and mode == "move" and not os.path.exists(file_path) and os.path.exists(target_path):
+                return
+            
+            # 重复文件硬链接到首个文件，无法创建硬链接时按普通文件处理
+            if link_target is not None:
+                try:
+                    os.link(link_target, target_path)
+                except OSError:
+                    pass
+                else:
+                    if mode == "move":
+                        os.unlink(file_path)
+                    return
+            
+            # 大文件分块复制，可以显示文件内进度并随时取消
+            is_large = file_size is not None and file_size >= self.LARGE_FILE_THRESHOLD
+            is_small = packer is not None and file_size is not None and 0 <= file_size < self.PACK_FILE_THRESHOLD
+            digests = []
+            if manifest is not None:
+                # 边复制边计算校验和，核对目标文件后再记录
+                def copy_function(src, dst):
+                    on_bytes = large_file_progress(plan_id, src, file_size) if is_large else None
+                    digests.append(copy_verified(src, dst, checksum, on_bytes=on_bytes,
+                                                 is_running=lambda: self.is_running))
+                    return dst
+            elif is_large:
+                def copy_function(src, dst):
+                    return copy_large_file(src, dst, on_bytes=large_file_progress(plan_id, src, file_size),
+                                           is_running=lambda: self.is_running)
+            else:
+                import shutil
+                copy_function = shutil.copy2
+            
+            if mode == "copy":
+                if previous_backup and self.link_unchanged(file_path, target_path, previous_backup, backup_folder):
+                    with linked_lock:
+                        linked_count += 1
+                    return
+                if is_small:
+                    pack_timed(file_path, target_path)
+                    return
+                copy_timed(copy_function, file_path, target_path)
+                if digests:
+                    manifest.add(digests[0], target_path)
+                return
+            
+            # 同一卷上直接重命名；源目录下挂载了其他卷时仍可能返回 EXDEV
+            if same_volume:
+                try:
+                    os.rename(file_path, target_path)
+                    return
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+            
+            # 跨卷移动：复制、校验（或写入 tar 包）后再删除源文件；提供 checksum 时 copy_verified
+            # 已经核对了内容，否则 verify_copy 只核对大小
+            if is_small:
+                pack_timed(file_path, target_path)
+                os.unlink(file_path)
+                return
+            copy_timed(copy_function, file_path, target_path, verify=True)
+            if digests:
+                manifest.add(digests[0], target_path)
+            os.unlink(file_path)
+        
+        # 正在分块复制的大文件已复制的字节数，在工作线程中更新
+        partial_bytes = {}
+        partial_lock = threading.Lock()
+        
+        def large_file_progress(plan_id, file_path, file_size):
+            # 没有总字节数时显示单个文件的复制进度，否则计入总进度
+            if not total_bytes:
+                return self.large_file_progress(file_path, file_size)
+            
+            def on_bytes(n):
+                with partial_lock:
+                    partial_bytes[plan_id] = partial_bytes.get(plan_id, 0) + n
+                report_progress()
+            return on_bytes
+        
+        def timed_operation(*job):
+            started = time.perf_counter()
+            try:
+                operation_func(*job)
+            finally:
+                metrics.observe('transfer_file', time.perf_counter() - started)
+        
+        def jobs(link):
+            for plan in plan_source(link):
+                yield plan['src'], plan['dst'], plan['size'], plan['id'], plan['link']
+        
+        success_count = 0
+        fail_count = 0
+        done_count = 0
+        done_bytes = 0
+        
+        def show_progress():
+            """按字节（没有总字节数时按文件数）更新进度条和状态文字"""
+            rates = self.describe_rates('transfer')
+            if not total:
+                self.update_status(f"处理中... 已完成 {done_count} 个文件（边扫描边转移），{rates}")
+                return
+            if not total_bytes:
+                progress = int(done_count / total * 100)
+                self.update_progress(progress)
+                self.update_status(f"处理中... {done_count}/{total} ({progress}%)，{rates}")
+                return
+            with partial_lock:
+                copied = done_bytes + sum(partial_bytes.values())
+            progress = min(100, int(copied / total_bytes * 100))
+            self.update_progress(progress)
+            status = (f"处理中... {done_count}/{total} 个文件，"
+                      f"{self.format_size(copied)}/{self.format_size(total_bytes)} ({progress}%)，{rates}")
+            elapsed = metrics.elapsed('transfer')
+            # 刚开始时速度还不稳定，一秒后再估计剩余时间
+            if copied and done_count < total and elapsed >= 1:
+                status += f"，剩余约 {self.format_duration(elapsed * (total_bytes - copied) / copied)}"
+            self.update_status(status)
+        
+        # 进度最多每 0.2 秒更新一次，最后一个文件总是更新
+        report_progress = throttle(0.2, show_progress)
+        
+        count_lock = threading.Lock()
+        
+        def on_complete(job, error):
+            # 在工作线程中立即记录结果，排在前面的大文件还没有完成时进度和转移日志也不会落后
+            _, _, file_size, plan_id, _ = job
+            nonlocal success_count, fail_count, done_count, done_bytes
+            with count_lock:
+                done_count += 1
+                if file_size and file_size > 0:
+                    done_bytes += file_size
+                if error is None:
+                    success_count += 1
+                else:
+                    fail_count += 1
+                last = done_count == total
+            with partial_lock:
+                partial_bytes.pop(plan_id, None)
+            if error is None:
+                metrics.count('transfer_files')
+                if file_size and file_size > 0:
+                    metrics.count('transfer_bytes', file_size)
+                journal.write('done', id=plan_id)
+            else:
+                metrics.count('transfer_failed')
+                journal.write('fail', id=plan_id, error=str(error))
+            report_progress(force=last)
+        
+        def on_done(job, error):
+            # 日志按计划顺序输出
+            file_path, target_path = job[:2]
+            if error is None:
+                self.log(f"{operation}成功: {os.path.basename(file_path)} -> {os.path.relpath(target_path, target)}")
+            else:
+                self.log(f"处理失败: {file_path} - {str(error)}")
+        
+        operation_func_timed = timed_operation
+        if self.profiler is not None:
+            operation_func_timed = self.profiler.wrap(timed_operation)
+        metrics.start_phase('transfer')
+        try:
+            engine = TransferEngine(operation_func_timed, lambda: self.is_running, per_device=per_device)
+            engine.run(jobs(False), on_done, on_complete)
+            
+            # 重复文件的硬链接要在首个文件转移完成之后创建
+            if self.is_running:
+                engine.run(jobs(True), on_done, on_complete)
+        finally:
+            metrics.end_phase('transfer')
+            # 停止或有失败的文件时不记录结束，之后可以继续
+            journal.close(finished=self.is_running and not fail_count)
+            if manifest is not None:
+                manifest.close()
+            if packer is not None:
+                packer.close()
+        
+        if linked_count:
+            self.log(f"增量备份: {linked_count} 个未变化的文件已硬链接到上一次备份")
+        self.log(f"转移速度: {self.describe_rates('transfer')}")
+        return success_count, fail_count
+    
+    @staticmethod
+    def copy_atomic(copy_function, src, dst, verify=False):
+        """先复制到同目录下的临时文件，完成（并校验）后再原子地重命名为目标文件"""
+        temp_path = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.part")
+        try:
+            copy_function(src, temp_path)
+            if verify:
+                FileTransferEngine.verify_copy(src, temp_path)
+            os.replace(temp_path, dst)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+    
+    @staticmethod
+    def is_same_device(path_a, path_b):
+        """检查两个路径是否位于同一设备，路径不存在时使用最近的已存在的上级目录"""
+        def device(path):
+            path = os.path.abspath(path)
+            while not os.path.exists(path):
+                parent = os.path.dirname(path)
+                if parent == path:
+                    return None
+                path = parent
+            return os.stat(path).st_dev
+        
+        dev_a = device(path_a)
+        return dev_a is not None and dev_a == device(path_b)
+    
+    @staticmethod
+    def describe_move_strategy(same_volume, checksum=None):
+        """返回移动方式的说明文字，跨磁盘时说明删除源文件之前核对的内容"""
+        if same_volume:
+            return "同一磁盘，直接重命名（速度很快）"
+        if checksum:
+            return f"跨磁盘，先复制并核对 {checksum} 校验和，一致后再删除源文件"
+        return "跨磁盘，先复制并核对文件大小（不比较内容，可勾选\"校验复制结果\"），再删除源文件"
+    
+    @staticmethod
+    def verify_copy(src, dst):
+        """核对复制结果的文件大小，不一致时删除目标文件并抛出 OSError
+
+        只比较大小；需要比较内容时复制函数使用 copy_verified，在复制的同时核对校验和。
+        """
+        src_size = os.stat(src).st_size
+        dst_size = os.stat(dst).st_size
+        if src_size != dst_size:
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+            raise OSError(f"校验失败: 源文件 {src_size} 字节，目标文件 {dst_size} 字节")
+    
+    def find_previous_backup(self, target, current_backup):
+        """返回目标文件夹下最近一次的备份文件夹，没有时返回 None"""
+        current_name = os.path.basename(current_backup)
+        try:
+            names = [entry.name for entry in os.scandir(target)
+                     if entry.is_dir() and self.BACKUP_FOLDER_PATTERN.match(entry.name)
+                     and entry.name != current_name]
+        except OSError:
+            return None
+        # 文件夹名中的时间戳可以直接按字符串排序
+        return os.path.join(target, max(names)) if names else None
+    
+    @staticmethod
+    def link_unchanged(file_path, target_path, previous_backup, backup_folder):
+        """上一次备份中相同位置的文件大小和修改时间都未变化时创建硬链接，成功返回 True"""
+        previous_path = os.path.join(previous_backup, os.path.relpath(target_path, backup_folder))
+        try:
+            previous_stat = os.stat(previous_path)
+            source_stat = os.stat(file_path)
+            if (previous_stat.st_size != source_stat.st_size
+                    or previous_stat.st_mtime_ns != source_stat.st_mtime_ns):
+                return False
+            os.link(previous_path, target_path)
+            return True
+        except OSError:
+            return False
+    
+    def write_duplicate_report(self, backup_folder, files, duplicates, action, name_index):
+        """在备份文件夹中写入重复文件报告，通过 name_index 分配名称，不会覆盖同名的转移文件"""
+        report_path = name_index.reserve(backup_folder, self.DUPLICATE_REPORT_NAME)
+        with open(report_path, 'w', encoding='utf-8-sig', newline='') as f:
+            import csv
+            writer = csv.writer(f)
+            writer.writerow(["重复文件", "首个文件", "大小", "处理方式"])
+            for index, primary in sorted(duplicates.items()):
+                file_info = files[index]
+                writer.writerow([file_info['path'], files[primary]['path'], file_info['size'], action])
+        self.log(f"已生成重复文件报告: {report_path}")
+    
+    def large_file_progress(self, file_path, file_size):
+        """返回大文件复制的字节进度回调，状态栏最多每 0.2 秒刷新一次"""
+        filename = os.path.basename(file_path)
+        copied = 0
+        last_update = 0
+        
+        def on_bytes(n):
+            nonlocal copied, last_update
+            copied += n
+            now = time.monotonic()
+            if now - last_update >= 0.2 or copied >= file_size:
+                last_update = now
+                percent = int(copied / file_size * 100) if file_size else 100
+                status = f"正在复制 {filename}: {self.format_size(copied)}/{self.format_size(file_size)} ({percent}%)"
+                self.update_status(status)
+        
+        return on_bytes
+    
+    def stream_files(self, source_dir, use_index=False):
+        """在后台线程中扫描，通过有界队列逐个产出文件信息
+
+        队列满时扫描线程等待转移赶上，因此内存占用与目录树大小无关。
+        """
+        batches = queue.Queue(maxsize=self.STREAM_QUEUE_DIRS)
+        finished = object()
+        errors = []
+        
+        def put(item):
+            while self.is_running:
+                try:
+                    batches.put(item, timeout=0.2)
+                    return
+                except queue.Full:
+                    continue
+        
+        def producer():
+            try:
+                self.scan_files(source_dir, use_index, on_files=lambda dirpath, files: put((dirpath, files)))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                put(finished)
+        
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        
+        completed = False
+        try:
+            while self.is_running:
+                try:
+                    item = batches.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                if item is finished:
+                    completed = True
+                    break
+                dirpath, files = item
+                for filename, file_size, file_type in files:
+                    file_name, file_ext = os.path.splitext(filename)
+                    yield {
+                        'path': os.path.join(dirpath, filename),
+                        'name': file_name,
+                        'ext': file_ext.lower(),
+                        'size': file_size,
+                        'type': file_type
+                    }
+        finally:
+            # 转移出错或生成器被提前关闭时停止扫描，扫描线程不再等待无人读取的队列
+            if not completed:
+                self.stop()
+            thread.join()
+        
+        if errors:
+            raise errors[0]
+    
+    def scan_files(self, source_dir, use_index=False, on_files=None):
+        """扫描源文件夹中的文件，use_index 为 True 时使用增量扫描索引
+
+        提供 on_files(dirpath, files) 时结果逐目录回调，不保存到 scanned_files；
+        否则保存全部结果，同时逐目录调用 on_scan_files（如果设置了）。
+        """
+        if on_files is not None:
+            # 流式转移中的扫描，统计在转移结束时一起保存
+            return self._scan_files(source_dir, use_index, on_files)
+        return self._instrumented(self._scan_files, source_dir, use_index, on_files)
+    
+    def _scan_files(self, source_dir, use_index, on_files):
+        self.scanned_files = ScanResults()  # 清空之前的扫描结果
+        if self.classifier is None:
+            self.classifier = self.build_classifier()
+        classifier = self.classifier
+        
+        # 微信等已知结构的目录只扫描其中的 msg 等文件夹
+        roots = self.locate_scan_roots(source_dir)
+        
+        scanner = ParallelScanner(
+            self.should_skip_dir,
+            classifier,
+            lambda: self.is_running,
+            exclude_dir=self.target,
+            log=self.log,
+            on_files=on_files or self.on_scan_files,
+            ignore_file_name=self.IGNORE_FILE_NAME,
+            keep_results=on_files is None,
+            metrics=self.metrics,
+            on_progress=throttle(0.5, self.report_scan_progress),
+            profiler=self.profiler,
+        )
+        
+        scanned_files = ScanResults()
+        self.metrics.start_phase('scan')
+        try:
+            if use_index:
+                scanner.index = ScanIndex(self.SCAN_INDEX_PATH)
+            for dirpath, files in scanner.scan_roots(roots):
+                scanned_files.add_dir(dirpath, files)
+        finally:
+            self.metrics.end_phase('scan')
+            if scanner.index is not None:
+                scanner.index.close()
+                self.log(f"增量扫描: {scanner.index.hits} 个目录使用索引，{scanner.index.misses} 个目录重新列举")
+        self.scanned_files = scanned_files
+        
+        self.log(f"扫描速度: {self.describe_rates('scan')}")
+        if on_files is None:
+            self.log(f"扫描完成，共找到 {len(self.scanned_files)} 个文件")
+        return self.scanned_files
+    
+    def locate_scan_roots(self, source_dir):
+        """按 SOURCE_PROFILES 确定需要扫描的目录，不属于已知结构或未找到时返回 [source_dir]"""
+        for profile in self.SOURCE_PROFILES:
+            if not profile.matches(source_dir):
+                continue
+            
+            cache = SourceProfileCache(self.SOURCE_PROFILE_CACHE_PATH)
+            roots = cache.lookup(profile.NAME, source_dir)
+            if roots is None:
+                roots, mtimes = profile.locate(source_dir, self.should_skip_dir, lambda: self.is_running)
+                if roots and self.is_running:
+                    cache.store(profile.NAME, source_dir, roots, mtimes)
+            
+            names = '/'.join(profile.ROOT_NAMES)
+            if not roots:
+                self.log(f"在{profile.DESCRIPTION}中未找到{names}文件夹，将扫描整个目录")
+                return [source_dir]
+            for root in roots:
+                self.log(f"检测到{profile.DESCRIPTION}，只扫描{names}文件夹: {root}")
+            return roots
+        return [source_dir]
+    
+    def report_scan_progress(self):
+        """在状态中显示扫描进度和速率"""
+        counters = self.metrics.counters
+        self.update_status(f"正在扫描... 已扫描 {counters.get('scan_dirs', 0)} 个目录，"
+                           f"找到 {counters.get('scan_files', 0)} 个文件（{self.describe_rates('scan')}）")
+    
+    @staticmethod
+    def format_duration(seconds):
+        """格式化剩余时间"""
+        seconds = int(seconds)
+        if seconds < 60:
+            return f"{seconds} 秒"
+        if seconds < 3600:
+            return f"{seconds // 60} 分 {seconds % 60} 秒"
+        return f"{seconds // 3600} 小时 {seconds // 60 % 60} 分"
+    
+    @staticmethod
+    def format_size(file_size):
+        """格式化文件大小"""
+        if file_size is None:
+            return "未知"
+        if file_size < 1024:
+            return f"{file_size} B"
+        elif file_size < 1024 * 1024:
+            return f"{file_size / 1024:.2f} KB"
+        elif file_size < 1024 * 1024 * 1024:
+            return f"{file_size / (1024 * 1024):.2f} MB"
+        else:
+            return f"{file_size / (1024 * 1024 * 1024):.2f} GB"
+    
+    # 写入转移日志的筛选条件，继续不完整的任务时按相同的条件重新扫描
+    SCAN_FILTERS = ('file_types', 'custom_extensions', 'min_size', 'max_size', 'min_mtime', 'max_mtime',
+                    'name_patterns')
+    
+    def scan_filters(self):
+        """返回当前的筛选条件"""
+        return {name: getattr(self, name) for name in self.SCAN_FILTERS}
+    
+    def apply_scan_filters(self, filters):
+        """使用保存的筛选条件，并重新编译文件分类器"""
+        for name in self.SCAN_FILTERS:
+            if name in filters:
+                setattr(self, name, filters[name])
+        self.classifier = self.build_classifier()
+    
+    def build_classifier(self):
+        """根据当前选项编译文件分类器"""
+        file_types = self.FILE_TYPES if self.file_types is None else self.file_types
+        selected_types = {file_type: extensions for file_type, extensions in self.FILE_TYPES.items()
+                          if file_type in file_types}
+        return FileClassifier(
+            selected_types,
+            custom_extensions=self.custom_extensions,
+            skip_extensions=self.CODE_FILE_EXTENSIONS + self.PROGRAM_FILE_EXTENSIONS,
+            skip_names=self.SKIP_FILE_NAMES,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            min_mtime=self.min_mtime,
+            max_mtime=self.max_mtime,
+            name_patterns=self.name_patterns,
+        )
+    
+    @staticmethod
+    def split_list(text):
+        """把逗号分隔的文本拆分为列表，忽略空项"""
+        return [item.strip() for item in text.split(',') if item.strip()]
+    
+    @staticmethod
+    def parse_size_mb(text, label):
+        """把以 MB 为单位的文本转换为字节数，留空返回 None，格式错误时抛出 ValueError"""
+        text = text.strip()
+        if not text:
+            return None
+        try:
+            return int(float(text) * 1024 * 1024)
+        except ValueError:
+            raise ValueError(f"{label}格式不正确: {text}")
+    
+    @staticmethod
+    def parse_date(text, label, end_of_day=False):
+        """把 YYYY-MM-DD 转换为时间戳，end_of_day 为 True 时取当天结束，留空返回 None"""
+        text = text.strip()
+        if not text:
+            return None
+        try:
+            timestamp = time.mktime(time.strptime(text, "%Y-%m-%d"))
+        except ValueError:
+            raise ValueError(f"{label}格式不正确，应为 YYYY-MM-DD: {text}")
+        return timestamp + 86400 if end_of_day else timestamp
+    
+    def should_skip_dir(self, dirname):
+        """检查是否应该跳过目录"""
+        return self.DIR_PRUNER(dirname)
+    
+    def should_skip_file(self, filename):
+        """检查是否应该跳过文件"""
+        if self.classifier is None:
+            self.classifier = self.build_classifier()
+        return self.classifier.is_skipped(filename)
+    
+    def get_file_type(self, filename):
+        """根据文件扩展名确定文件类型"""
+        if self.classifier is None:
+            self.classifier = self.build_classifier()
+        return self.classifier.table.get(os.path.splitext(filename)[1].lower()) or '其他'
+
+
+# 命令行退出码
+EXIT_OK = 0  # 全部成功
+EXIT_FAILURES = 1  # 部分文件处理失败
+EXIT_ERROR = 2  # 参数错误或任务无法进行
+EXIT_INTERRUPTED = 130  # 被用户中断
+
+
+class JsonLinesWriter:
+    """把事件逐行输出为 JSON，可以被多个线程同时调用"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def __call__(self, event, **fields):
+        fields = {'event': event, **fields}
+        line = json.dumps(fields, ensure_ascii=False) + '\n'
+        with self._lock:
+            self.stream.write(line)
+            self.stream.flush()
+
+
+def build_parser():
+    """创建命令行参数解析器"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='file_transfer_engine',
+        description='文件转移工具命令行版本，进度和结果以 JSON 行输出到标准输出')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_instrumentation_options(command):
+        command.add_argument('--metrics', metavar='PATH',
+                             help='结束时保存统计，扩展名为 .prom 时使用 Prometheus 文本格式，否则为 JSON')
+        command.add_argument('--profile', metavar='PATH', help='用 cProfile 分析并把结果保存到该文件')
+
+    def add_filter_options(command, index=True):
+        command.add_argument('--types', help='要扫描的文件类型，逗号分隔，默认全部: '
+                             + ','.join(FileTransferEngine.FILE_TYPES))
+        command.add_argument('--ext', default='', help='临时扫描类型的扩展名，逗号分隔，如 .xyz,.abc')
+        command.add_argument('--min-size', default='', help='文件大小下限（MB）')
+        command.add_argument('--max-size', default='', help='文件大小上限（MB）')
+        command.add_argument('--since', default='', help='修改日期起始，YYYY-MM-DD')
+        command.add_argument('--until', default='', help='修改日期截止，YYYY-MM-DD')
+        command.add_argument('--name', default='', help='文件名通配符，逗号分隔，如 IMG_*,*合同*')
+        if index:
+            command.add_argument('--index', action='store_true', help='使用增量扫描索引')
+
+    def add_transfer_options(command):
+        command.add_argument('--per-device', type=int, default=FileTransferEngine.PER_DEVICE_CONCURRENCY,
+                             help='每设备并发数')
+
+    scan = commands.add_parser('scan', help='扫描源文件夹，逐个输出符合条件的文件')
+    scan.add_argument('source')
+    scan.add_argument('--target', default='', help='扫描时跳过的目标文件夹')
+    add_filter_options(scan)
+    add_instrumentation_options(scan)
+
+    for mode, help_text in (('copy', '复制文件到目标文件夹'), ('move', '移动文件到目标文件夹')):
+        command = commands.add_parser(mode, help=help_text)
+        command.add_argument('source')
+        command.add_argument('target')
+        add_filter_options(command)
+        add_transfer_options(command)
+        add_instrumentation_options(command)
+        command.add_argument('--flat', action='store_true', help='不按文件类型分类')
+        command.add_argument('--stream', action='store_true', help='边扫描边转移')
+        command.add_argument('--duplicates', choices=[v for v in FileTransferEngine.DUPLICATE_MODES.values() if v],
+                             help='重复文件处理方式')
+        command.add_argument('--incremental', action='store_true', help='增量备份（仅复制模式）')
+        command.add_argument('--verify', nargs='?', const='blake2b', choices=list(HASH_ALGORITHMS),
+                             help='复制时校验文件内容，可指定算法，默认 blake2b')
+        command.add_argument('--pack', action='store_true', help='小文件写入 tar 包')
+        command.add_argument('--order', choices=[v for v in FileTransferEngine.TRANSFER_ORDERS.values() if v],
+                             help='转移顺序，默认按扫描顺序')
+
+    watch = commands.add_parser('watch', help='监视源文件夹，把新建或修改的文件持续转移到目标文件夹，按 Ctrl+C 结束')
+    watch.add_argument('source')
+    watch.add_argument('target')
+    add_filter_options(watch, index=False)
+    add_transfer_options(watch)
+    add_instrumentation_options(watch)
+    watch.add_argument('--move', action='store_true', help='移动而不是复制')
+    watch.add_argument('--flat', action='store_true', help='不按文件类型分类')
+    watch.add_argument('--incremental', action='store_true', help='增量备份（仅复制模式）')
+    watch.add_argument('--verify', nargs='?', const='blake2b', choices=list(HASH_ALGORITHMS),
+                       help='复制时校验文件内容，可指定算法，默认 blake2b')
+    watch.add_argument('--settle', type=float, default=FileTransferEngine.WATCH_SETTLE_SECONDS,
+                       help='文件连续多少秒不变才认为写入完成')
+    watch.add_argument('--poll', action='store_true', help='不使用 inotify，定期轮询（适合网络共享）')
+
+    resume = commands.add_parser('resume', help='继续备份文件夹中未完成的任务')
+    resume.add_argument('backup_folder')
+    add_transfer_options(resume)
+    add_instrumentation_options(resume)
+    return parser
+
+
+def _run_interruptible(engine, func, *args, graceful=False):
+    """在工作线程中执行任务，主线程收到 Ctrl+C 时停止引擎并等待任务收尾
+
+    graceful 为 True 时 Ctrl+C 是正常的结束方式（监视模式），收尾后返回任务的结果而不是抛出 KeyboardInterrupt。
+    """
+    result = {}
+    finished = threading.Event()
+
+    def target():
+        try:
+            result['value'] = func(*args)
+        except BaseException as e:
+            result['error'] = e
+        finally:
+            finished.set()
+
+    # 等待 Event 而不是 join()：join() 被 Ctrl+C 打断后，is_alive() 可能在线程结束前就返回 False
+    threading.Thread(target=target, daemon=True).start()
+    try:
+        while not finished.wait(0.2):
+            pass
+    except KeyboardInterrupt:
+        # 等待任务关闭转移日志、保存统计后再退出，等待期间再次按 Ctrl+C 也不中断收尾
+        engine.stop()
+        while True:
+            try:
+                if finished.wait(0.2):
+                    break
+            except KeyboardInterrupt:
+                continue
+        if not graceful:
+            raise
+    if 'error' in result:
+        raise result['error']
+    return result.get('value')
+
+
+def main(argv=None):
+    """命令行入口，返回退出码"""
+    args = build_parser().parse_args(argv)
+    emit = JsonLinesWriter()
+
+    try:
+        options = {}
+        if args.command != 'resume':
+            split = FileTransferEngine.split_list
+            options.update(
+                target=getattr(args, 'target', ''),
+                file_types=split(args.types) if args.types else None,
+                custom_extensions=split(args.ext),
+                min_size=FileTransferEngine.parse_size_mb(args.min_size, "文件大小下限"),
+                max_size=FileTransferEngine.parse_size_mb(args.max_size, "文件大小上限"),
+                min_mtime=FileTransferEngine.parse_date(args.since, "起始日期"),
+                max_mtime=FileTransferEngine.parse_date(args.until, "截止日期", end_of_day=True),
+                name_patterns=split(args.name),
+            )
+        if args.command == 'watch':
+            options.update(
+                organize_by_type=not args.flat,
+                incremental_backup=args.incremental,
+                checksum=args.verify,
+            )
+        if args.command in ('copy', 'move'):
+            options.update(
+                organize_by_type=not args.flat,
+                duplicate_mode=args.duplicates,
+                incremental_backup=args.incremental,
+                checksum=args.verify,
+                pack_small_files=args.pack,
+                transfer_order=args.order,
+            )
+        if args.command != 'scan':
+            options['per_device_limit'] = args.per_device
+        engine = FileTransferEngine(
+            on_log=lambda message: emit('log', message=message),
+            on_status=lambda status: emit('status', status=status),
+            on_progress=lambda percent: emit('progress', percent=percent),
+            metrics_path=args.metrics,
+            profile_path=args.profile,
+            **options,
+        )
+    except ValueError as e:
+        emit('error', message=str(e))
+        return EXIT_ERROR
+
+    try:
+        if args.command == 'scan':
+            if not os.path.isdir(args.source):
+                raise ValueError(f"源文件夹不存在: {args.source}")
+            count = 0
+
+            def on_files(dirpath, files):
+                nonlocal count
+                count += len(files)
+                for filename, file_size, file_type in files:
+                    emit('file', path=os.path.join(dirpath, filename), size=file_size, type=file_type)
+
+            try:
+                _run_interruptible(engine, engine.scan_files, args.source, args.index, on_files)
+            finally:
+                engine.finish_run()
+            emit('summary', command='scan', files=count, stopped=not engine.is_running)
+            return EXIT_OK
+
+        if args.command == 'resume':
+            if not TransferJournal.exists(args.backup_folder):
+                raise ValueError(f"该文件夹中没有转移日志: {args.backup_folder}")
+            success_count, fail_count = _run_interruptible(engine, engine.resume_transfer, args.backup_folder)
+        elif args.command == 'watch':
+            if not os.path.isdir(args.source):
+                raise ValueError(f"源文件夹不存在: {args.source}")
+            success_count, fail_count = _run_interruptible(
+                engine, engine.watch_files, args.source, args.target, 'move' if args.move else 'copy',
+                args.settle, not args.poll, graceful=True)
+        else:
+            if not os.path.isdir(args.source):
+                raise ValueError(f"源文件夹不存在: {args.source}")
+
+            def transfer():
+                if args.stream:
+                    files = engine.stream_files(args.source, args.index)
+                else:
+                    engine.scan_files(args.source, args.index)
+                    if not engine.is_running:
+                        return 0, 0
+                    files = None
+                return engine.transfer_files(args.source, args.target, args.command, files)
+
+            success_count, fail_count = _run_interruptible(engine, transfer)
+        emit('summary', command=args.command, success=success_count, fail=fail_count,
+             stopped=not engine.is_running)
+        return EXIT_FAILURES if fail_count else EXIT_OK
+    except KeyboardInterrupt:
+        emit('summary', command=args.command, stopped=True)
+        return EXIT_INTERRUPTED
+    except Exception as e:
+        emit('error', message=str(e))
+        return EXIT_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main())
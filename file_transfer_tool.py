@@ -6,51 +6,28 @@
 """
 
 import os
-import shutil
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import threading
-from pathlib import Path
+import queue
 import time
 
+from file_transfer_engine import FileTransferEngine, ScanResults, ScanResultIndex, TransferJournal, HASH_ALGORITHMS
+
 
 class FileTransferTool:
-    """文件转移工具主类"""
-    
-    # 定义常用文件类型
-    FILE_TYPES = {
-        '图片': ['.jpg', '.jpeg', '.png', '.gif'],
-        '音乐': ['.mp3'],
-        '视频': ['.mp4'],
-        '文档': ['.pdf', '.doc', '.docx', '.txt'],
-        '表格': ['.xls', '.xlsx', '.csv'],
-        '演示': ['.ppt', '.pptx'],
-        '压缩': ['.zip', '.rar', '.7z'],
-        
-    }
+    """文件转移工具主类，扫描和转移由 FileTransferEngine 完成，这里只负责界面"""
     
-    # 程序类文件扩展名，需要跳过
-    PROGRAM_FILE_EXTENSIONS = [
-        '.exe', '.msi', '.dmg', '.pkg', '.deb', '.rpm', '.apk', '.app', '.command',
-        '.appimage', '.snap', '.flatpak', '.bin', '.run', '.out', '.jar', '.war'
-    ]
+    # 界面每次刷新最多插入的结果行数，以及刷新间隔（毫秒），限制扫描结果的渲染帧率
+    RESULT_BATCH_SIZE = 500
+    UI_REFRESH_MS = 50
     
-    # 代码格式文件扩展名，需要跳过
-    CODE_FILE_EXTENSIONS = [
-        '.py', '.js', '.html', '.css', '.java', '.cpp', '.c', '.h', '.cs', '.php',
-        '.rb', '.go', '.rs', '.swift', '.kt', '.scala', '.r', '.m', '.sh', '.bat',
-        '.ps1', '.sql', '.xml', '.json', '.yaml', '.yml', '.toml', '.ini', '.cfg',
-        '.conf', '.log', '.md', '.tex', '.less', '.sass', '.scss', '.vue', '.jsx',
-        '.tsx', '.ts', '.dart', '.lua', '.pl', '.vb', '.asm', '.s', '.dockerfile'
-    ]
+    # 扫描时和筛选结果后最多显示的行数，以及输入筛选条件后等待多久（毫秒）再查询
+    RESULT_VIEW_LIMIT = 5000
+    VIEW_REFRESH_DELAY_MS = 150
     
-    # 系统和缓存文件目录，需要跳过
-    SKIP_DIRS = [
-        '$Recycle.Bin', 'System Volume Information', 'RECYCLER',
-        'Windows', 'Program Files', 'Program Files (x86)', 'ProgramData',
-        'AppData', 'Temp', 'tmp', 'cache', 'Cache', '.cache',
-        '__pycache__', 'node_modules', '.git', '.svn'
-    ]
+    # 可以点击排序的列
+    SORT_COLUMNS = {"文件名": 'name', "大小": 'size', "路径": 'path'}
     
     def __init__(self, root):
         """初始化文件转移工具"""
@@ -65,17 +42,50 @@ class FileTransferTool:
         self.source_path = tk.StringVar()
         self.target_path = tk.StringVar()
         self.organize_by_type = tk.BooleanVar(value=True)
+        self.use_scan_index = tk.BooleanVar(value=False)  # 使用增量扫描索引，文件大小等可能过时，默认不使用
+        self.streaming_mode = tk.BooleanVar(value=False)  # 边扫描边转移
+        self.duplicate_mode = tk.StringVar(value='不处理')  # 重复文件处理方式
+        self.incremental_backup = tk.BooleanVar(value=False)  # 未变化的文件硬链接到上一次备份
+        self.per_device_limit = tk.IntVar(value=FileTransferEngine.PER_DEVICE_CONCURRENCY)  # 每设备并发数
+        self.verify_copies = tk.BooleanVar(value=False)  # 复制时计算并核对校验和
+        self.checksum_algorithm = tk.StringVar(value='blake2b')  # 校验和算法
+        self.pack_small_files = tk.BooleanVar(value=False)  # 小文件写入 tar 包
+        self.transfer_order = tk.StringVar(value='扫描顺序')  # 转移顺序
         self.custom_extensions = tk.StringVar()  # 用户自定义扩展名
+        self.min_size_mb = tk.StringVar()  # 文件大小下限（MB）
+        self.max_size_mb = tk.StringVar()  # 文件大小上限（MB）
+        self.start_date = tk.StringVar()  # 修改日期起始（YYYY-MM-DD）
+        self.end_date = tk.StringVar()  # 修改日期截止（YYYY-MM-DD）
+        self.name_patterns = tk.StringVar()  # 文件名通配符
+        self.view_type = tk.StringVar(value='全部')  # 扫描结果筛选: 文件类型
+        self.view_min_mb = tk.StringVar()  # 扫描结果筛选: 大小下限（MB）
+        self.view_max_mb = tk.StringVar()  # 扫描结果筛选: 大小上限（MB）
+        self.view_name = tk.StringVar()  # 扫描结果筛选: 文件名包含的文字
+        self.view_sort = None  # 扫描结果排序方式，None 为扫描顺序
+        self.view_descending = False
+        self.engine = None  # 当前扫描或转移使用的引擎
         self.is_running = False
-        self.scanned_files = []  # 存储扫描到的文件信息
+        self.scanned_files = ScanResults()  # 存储扫描到的文件信息
+        self.result_index = None  # 扫描完成后建立的结果索引
+        self.selection = None  # 筛选出的文件编号，None 表示全部扫描结果
+        self._view_job = None
+        self.result_queue = queue.SimpleQueue()  # 扫描线程推送、界面定时批量取出的结果行
+        self.engine_updates = queue.SimpleQueue()  # 引擎在工作线程中报告的状态和进度，界面定时取出
+        self._pending_rows = []
+        self._pending_pos = 0
+        self._drain_job = None
+        self._published_rows = 0  # 扫描时已放入结果队列的行数，最多 RESULT_VIEW_LIMIT
+        self._found_rows = 0  # 扫描时找到的文件数
+        self._publish_lock = threading.Lock()
         
         # 文件类型选择变量
         self.file_type_vars = {}
-        for file_type in self.FILE_TYPES:
+        for file_type in FileTransferEngine.FILE_TYPES:
             self.file_type_vars[file_type] = tk.BooleanVar(value=True)
         
         # 创建UI
         self.create_ui()
+        self.root.after(self.UI_REFRESH_MS, self.poll_engine_updates)
     
     def create_ui(self):
         """创建用户界面"""
@@ -103,6 +113,41 @@ class FileTransferTool:
         
         # 其他选项
         ttk.Checkbutton(options_frame, text="按文件类型分类", variable=self.organize_by_type).pack(anchor=tk.W, pady=2)
+        ttk.Checkbutton(options_frame, text="增量扫描（跳过未变化的目录）", variable=self.use_scan_index).pack(anchor=tk.W, pady=2)
+        ttk.Checkbutton(options_frame, text="增量备份（复制时未变化的文件硬链接到上一次的备份文件夹）",
+                        variable=self.incremental_backup).pack(anchor=tk.W, pady=2)
+        ttk.Checkbutton(options_frame, text="小文件打包（小于 1 MB 的文件写入每个分类一个的 tar 包，适合大量小文件）",
+                        variable=self.pack_small_files).pack(anchor=tk.W, pady=2)
+        ttk.Checkbutton(options_frame, text="边扫描边转移（无需先扫描，适合超大目录）", variable=self.streaming_mode,
+                        command=self.update_transfer_buttons).pack(anchor=tk.W, pady=2)
+        
+        duplicate_frame = ttk.Frame(options_frame)
+        duplicate_frame.pack(fill=tk.X, pady=2)
+        ttk.Label(duplicate_frame, text="重复文件:").pack(side=tk.LEFT)
+        ttk.Combobox(duplicate_frame, textvariable=self.duplicate_mode, values=list(FileTransferEngine.DUPLICATE_MODES),
+                     state="readonly", width=16).pack(side=tk.LEFT, padx=5)
+        ttk.Label(duplicate_frame, text="(按内容识别，报告保存在备份文件夹中；边扫描边转移时不可用)").pack(side=tk.LEFT)
+        
+        order_frame = ttk.Frame(options_frame)
+        order_frame.pack(fill=tk.X, pady=2)
+        ttk.Label(order_frame, text="转移顺序:").pack(side=tk.LEFT)
+        ttk.Combobox(order_frame, textvariable=self.transfer_order, values=list(FileTransferEngine.TRANSFER_ORDERS),
+                     state="readonly", width=16).pack(side=tk.LEFT, padx=5)
+        ttk.Label(order_frame, text="(机械硬盘建议按目录位置；边扫描边转移时按扫描顺序)").pack(side=tk.LEFT)
+        
+        checksum_frame = ttk.Frame(options_frame)
+        checksum_frame.pack(fill=tk.X, pady=2)
+        ttk.Checkbutton(checksum_frame, text="校验复制结果", variable=self.verify_copies).pack(side=tk.LEFT)
+        ttk.Combobox(checksum_frame, textvariable=self.checksum_algorithm, values=list(HASH_ALGORITHMS),
+                     state="readonly", width=10).pack(side=tk.LEFT, padx=5)
+        ttk.Label(checksum_frame, text="(复制时同步计算校验和，清单保存在备份文件夹中)").pack(side=tk.LEFT)
+        
+        concurrency_frame = ttk.Frame(options_frame)
+        concurrency_frame.pack(fill=tk.X, pady=2)
+        ttk.Label(concurrency_frame, text="每设备并发数:").pack(side=tk.LEFT)
+        ttk.Spinbox(concurrency_frame, from_=1, to=FileTransferEngine.TRANSFER_WORKERS, textvariable=self.per_device_limit,
+                    width=5).pack(side=tk.LEFT, padx=5)
+        ttk.Label(concurrency_frame, text="(机械硬盘建议 1-2，SSD 和网络共享可适当调高)").pack(side=tk.LEFT)
         
         # 文件类型选择
         file_type_frame = ttk.LabelFrame(options_frame, text="文件类型选择")
@@ -114,7 +159,7 @@ class FileTransferTool:
         
         # 每行显示3个复选框
         col = 0
-        for file_type in self.FILE_TYPES:
+        for file_type in FileTransferEngine.FILE_TYPES:
             if col % 3 == 0:
                 row_frame = ttk.Frame(checkbox_frame)
                 row_frame.pack(fill=tk.X, pady=2)
@@ -137,6 +182,22 @@ class FileTransferTool:
         ttk.Entry(custom_frame, textvariable=self.custom_extensions, width=50).pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         ttk.Label(custom_frame, text="(输入扩展名，用逗号分隔，如: .xyz,.abc)").pack(side=tk.LEFT)
         
+        # 筛选规则选项
+        filter_frame = ttk.Frame(options_frame)
+        filter_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(filter_frame, text="文件大小(MB):").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(filter_frame, textvariable=self.min_size_mb, width=8).pack(side=tk.LEFT)
+        ttk.Label(filter_frame, text="-").pack(side=tk.LEFT)
+        ttk.Entry(filter_frame, textvariable=self.max_size_mb, width=8).pack(side=tk.LEFT)
+        ttk.Label(filter_frame, text="修改日期:").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(filter_frame, textvariable=self.start_date, width=12).pack(side=tk.LEFT)
+        ttk.Label(filter_frame, text="至").pack(side=tk.LEFT)
+        ttk.Entry(filter_frame, textvariable=self.end_date, width=12).pack(side=tk.LEFT)
+        ttk.Label(filter_frame, text="文件名匹配:").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(filter_frame, textvariable=self.name_patterns, width=20).pack(side=tk.LEFT, fill=tk.X, expand=True)
+        ttk.Label(filter_frame, text="(留空不限，如: IMG_*,*合同*)").pack(side=tk.LEFT)
+        
         # 操作按钮
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(fill=tk.X, pady=10)
@@ -150,6 +211,9 @@ class FileTransferTool:
         self.move_button = ttk.Button(button_frame, text="移动到目标文件夹", command=lambda: self.start_transfer("move"), state=tk.DISABLED)
         self.move_button.pack(side=tk.LEFT, padx=5)
         
+        self.resume_button = ttk.Button(button_frame, text="继续未完成任务", command=self.resume_transfer_button)
+        self.resume_button.pack(side=tk.LEFT, padx=5)
+        
         self.stop_button = ttk.Button(button_frame, text="停止", command=self.stop_transfer, state=tk.DISABLED)
         self.stop_button.pack(side=tk.LEFT, padx=5)
         
@@ -170,13 +234,36 @@ class FileTransferTool:
         log_frame = ttk.LabelFrame(main_frame, text="扫描结果", padding="10")
         log_frame.pack(fill=tk.BOTH, expand=True, pady=5)
         
+        # 扫描结果筛选，只查询内存中的索引，不重新扫描
+        view_frame = ttk.Frame(log_frame)
+        view_frame.pack(side=tk.TOP, fill=tk.X, pady=(0, 5))
+        
+        ttk.Label(view_frame, text="类型:").pack(side=tk.LEFT, padx=5)
+        self.view_type_box = ttk.Combobox(view_frame, textvariable=self.view_type, values=['全部'],
+                                          state='readonly', width=10)
+        self.view_type_box.pack(side=tk.LEFT)
+        ttk.Label(view_frame, text="大小(MB):").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(view_frame, textvariable=self.view_min_mb, width=8).pack(side=tk.LEFT)
+        ttk.Label(view_frame, text="-").pack(side=tk.LEFT)
+        ttk.Entry(view_frame, textvariable=self.view_max_mb, width=8).pack(side=tk.LEFT)
+        ttk.Label(view_frame, text="名称包含:").pack(side=tk.LEFT, padx=5)
+        ttk.Entry(view_frame, textvariable=self.view_name, width=20).pack(side=tk.LEFT)
+        self.selection_label = ttk.Label(view_frame, text="")
+        self.selection_label.pack(side=tk.LEFT, padx=10)
+        
+        for var in (self.view_type, self.view_min_mb, self.view_max_mb, self.view_name):
+            var.trace_add('write', lambda *args: self.schedule_view_refresh())
+        
         # 创建Treeview显示文件信息
         columns = ("文件名", "扩展名", "大小", "路径")
         self.file_tree = ttk.Treeview(log_frame, columns=columns, show="headings", height=10)
         
-        # 设置列标题
+        # 设置列标题，点击文件名、大小、路径列按该列排序
         for col in columns:
-            self.file_tree.heading(col, text=col)
+            if col in self.SORT_COLUMNS:
+                self.file_tree.heading(col, text=col, command=lambda col=col: self.sort_view(col))
+            else:
+                self.file_tree.heading(col, text=col)
             self.file_tree.column(col, width=150)
         
         # 添加滚动条
@@ -216,9 +303,84 @@ class FileTransferTool:
         print(f"[{timestamp}] {message}")  # 在控制台输出日志
     
     def update_status(self, status):
-        """更新状态标签"""
+        """更新状态标签，只能在界面线程中调用"""
         self.status_label.config(text=status)
     
+    def post_status(self, status):
+        """在工作线程中报告状态，由界面线程显示"""
+        self.engine_updates.put(('status', status))
+    
+    def post_progress(self, percent):
+        """在工作线程中报告进度，由界面线程显示"""
+        self.engine_updates.put(('progress', percent))
+    
+    def apply_engine_updates(self):
+        """取出工作线程报告的状态和进度，只显示最新的一条"""
+        latest = {}
+        while True:
+            try:
+                kind, value = self.engine_updates.get_nowait()
+            except queue.Empty:
+                break
+            latest[kind] = value
+        if 'status' in latest:
+            self.update_status(latest['status'])
+        if 'progress' in latest:
+            self.progress.config(value=latest['progress'])
+    
+    def poll_engine_updates(self):
+        """定时显示工作线程报告的状态和进度，Tk 控件只在界面线程中访问"""
+        self.apply_engine_updates()
+        self.root.after(self.UI_REFRESH_MS, self.poll_engine_updates)
+    
+    def create_engine(self):
+        """根据当前界面选项创建引擎，选项格式错误时抛出 ValueError"""
+        engine = FileTransferEngine
+        try:
+            per_device = max(1, int(self.per_device_limit.get()))
+        except (tk.TclError, ValueError):
+            per_device = engine.PER_DEVICE_CONCURRENCY
+        return engine(
+            target=self.target_path.get(),
+            organize_by_type=self.organize_by_type.get(),
+            file_types=[file_type for file_type, var in self.file_type_vars.items() if var.get()],
+            custom_extensions=engine.split_list(self.custom_extensions.get()),
+            min_size=engine.parse_size_mb(self.min_size_mb.get(), "文件大小下限"),
+            max_size=engine.parse_size_mb(self.max_size_mb.get(), "文件大小上限"),
+            min_mtime=engine.parse_date(self.start_date.get(), "起始日期"),
+            max_mtime=engine.parse_date(self.end_date.get(), "截止日期", end_of_day=True),
+            name_patterns=engine.split_list(self.name_patterns.get()),
+            duplicate_mode=engine.DUPLICATE_MODES.get(self.duplicate_mode.get()),
+            incremental_backup=self.incremental_backup.get(),
+            per_device_limit=per_device,
+            checksum=self.checksum_algorithm.get() if self.verify_copies.get() else None,
+            pack_small_files=self.pack_small_files.get(),
+            transfer_order=engine.TRANSFER_ORDERS.get(self.transfer_order.get()),
+            on_log=self.log,
+            on_status=self.post_status,
+            on_progress=self.post_progress,
+            on_scan_files=self.publish_rows,
+        )
+    
+    def publish_rows(self, dirpath, files):
+        """在扫描线程中格式化好整批结果行，界面线程只负责插入
+
+        结果列表最多显示 RESULT_VIEW_LIMIT 行，之后只计数，结果队列的内存占用有上限。
+        """
+        with self._publish_lock:
+            self._found_rows += len(files)
+            room = self.RESULT_VIEW_LIMIT - self._published_rows
+            if room <= 0:
+                return
+            files = files[:room]
+            self._published_rows += len(files)
+        rows = []
+        for filename, file_size, _ in files:
+            file_name, file_ext = os.path.splitext(filename)
+            rows.append((file_name, file_ext.lower(), FileTransferEngine.format_size(file_size),
+                         os.path.join(dirpath, filename)))
+        self.result_queue.put(rows)
+    
     def scan_files_button(self):
         """扫描文件按钮点击事件"""
         if self.is_running:
@@ -228,6 +390,13 @@ class FileTransferTool:
         if not source or not os.path.exists(source):
             messagebox.showerror("错误", "请选择有效的源文件夹")
             return
+        
+        # 在界面线程中读取选项并编译分类器
+        try:
+            self.engine = self.create_engine()
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+            return
             
         self.is_running = True
         self.scan_button.config(state=tk.DISABLED)
@@ -235,24 +404,76 @@ class FileTransferTool:
         
         # 清空之前的扫描结果
         self.file_tree.delete(*self.file_tree.get_children())
-        self.scanned_files = []
+        self.scanned_files = ScanResults()
+        self.result_index = None
+        self.selection = None
+        self.selection_label.config(text="")
+        self.result_queue = queue.SimpleQueue()
+        self._pending_rows = []
+        self._pending_pos = 0
+        with self._publish_lock:
+            self._published_rows = 0
+            self._found_rows = 0
         
         # 在新线程中执行扫描
-        threading.Thread(target=self.scan_files_thread, args=(source,), daemon=True).start()
+        threading.Thread(target=self.scan_files_thread, args=(source, self.use_scan_index.get()), daemon=True).start()
+        
+        # 定时批量刷新扫描结果
+        if self._drain_job is None:
+            self._drain_job = self.root.after(self.UI_REFRESH_MS, self.drain_results)
+    
+    def drain_results(self):
+        """从结果队列中批量取出扫描结果并插入Treeview"""
+        budget = self.RESULT_BATCH_SIZE
+        while budget > 0:
+            if self._pending_pos >= len(self._pending_rows):
+                try:
+                    self._pending_rows = self.result_queue.get_nowait()
+                except queue.Empty:
+                    self._pending_rows = []
+                    self._pending_pos = 0
+                    break
+                self._pending_pos = 0
+            
+            chunk = self._pending_rows[self._pending_pos:self._pending_pos + budget]
+            for values in chunk:
+                self.file_tree.insert("", tk.END, values=values)
+            self._pending_pos += len(chunk)
+            budget -= len(chunk)
+        self.show_scan_count()
+        
+        # 扫描结束且队列清空后停止刷新
+        if self.is_running or self._pending_rows or not self.result_queue.empty():
+            self._drain_job = self.root.after(self.UI_REFRESH_MS, self.drain_results)
+        else:
+            self._drain_job = None
         
-    def scan_files_thread(self, source):
+    def show_scan_count(self):
+        """扫描结果超过 RESULT_VIEW_LIMIT 个时显示实际找到的数量"""
+        found = self._found_rows
+        if found > self.RESULT_VIEW_LIMIT:
+            self.selection_label.config(text=f"显示前 {self.RESULT_VIEW_LIMIT} 个文件，共找到 {found} 个")
+    
+    def scan_files_thread(self, source, use_index=False):
         """在后台线程中扫描文件"""
         try:
-            self.scan_files(source)
+            self.engine.scan_files(source, use_index)
+            self.scanned_files = self.engine.scanned_files
+            
+            # 建立结果索引，之后筛选和排序都不需要重新扫描
+            if self.scanned_files:
+                self.post_status("正在建立结果索引...")
+                self.result_index = ScanResultIndex(self.scanned_files)
             
             # 扫描完成后更新UI
             self.root.after(0, self.scan_complete)
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("错误", f"扫描过程中发生错误: {str(e)}"))
+            self.root.after(0, lambda message=str(e): messagebox.showerror("错误", f"扫描过程中发生错误: {message}"))
             self.root.after(0, self.reset_ui)
             
     def scan_complete(self):
         """扫描完成后的UI更新"""
+        self.apply_engine_updates()  # 先显示引擎最后报告的状态，避免覆盖下面的状态
         self.is_running = False
         self.scan_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
@@ -261,12 +482,94 @@ class FileTransferTool:
         if self.scanned_files:
             self.copy_button.config(state=tk.NORMAL)
             self.move_button.config(state=tk.NORMAL)
+            self.update_status(f"扫描完成，共 {len(self.scanned_files)} 个文件")
+            self.view_type_box.config(values=['全部'] + self.scanned_files.type_names)
+            if self.view_type.get() not in self.scanned_files.type_names:
+                self.view_type.set('全部')
+            if self.view_filtered() or self.view_sort is not None:
+                self.refresh_view()
             messagebox.showinfo("扫描完成", f"共扫描到 {len(self.scanned_files)} 个文件")
         else:
             messagebox.showinfo("扫描完成", "未找到符合条件的文件")
             
+    def view_filtered(self):
+        """检查是否设置了扫描结果的筛选条件"""
+        return (self.view_type.get() != '全部' or self.view_min_mb.get().strip()
+                or self.view_max_mb.get().strip() or self.view_name.get().strip())
+    
+    def schedule_view_refresh(self):
+        """筛选条件变化后稍等片刻再查询，连续输入时只查询一次"""
+        if self._view_job is not None:
+            self.root.after_cancel(self._view_job)
+        self._view_job = self.root.after(self.VIEW_REFRESH_DELAY_MS, self.refresh_view)
+    
+    def sort_view(self, column):
+        """点击列标题排序，再次点击同一列时倒序"""
+        key = self.SORT_COLUMNS[column]
+        if key == self.view_sort:
+            self.view_descending = not self.view_descending
+        else:
+            self.view_sort = key
+            self.view_descending = key == 'size'  # 按大小排序时先显示大文件
+        self.refresh_view()
+    
+    def refresh_view(self):
+        """从结果索引中查询符合筛选条件的文件并重新显示"""
+        self._view_job = None
+        index = self.result_index
+        if index is None or self.is_running:
+            return
+        
+        engine = FileTransferEngine
+        try:
+            min_size = engine.parse_size_mb(self.view_min_mb.get(), "大小下限")
+            max_size = engine.parse_size_mb(self.view_max_mb.get(), "大小上限")
+        except ValueError as e:
+            self.selection_label.config(text=str(e))
+            return
+        file_type = self.view_type.get()
+        self.selection = index.query(
+            file_types=None if file_type == '全部' else {file_type},
+            min_size=min_size,
+            max_size=max_size,
+            name=self.view_name.get().strip() or None,
+            sort=self.view_sort,
+            descending=self.view_descending,
+        )
+        self.show_selection()
+    
+    def show_selection(self):
+        """在结果列表中显示筛选出的文件，最多显示 RESULT_VIEW_LIMIT 行"""
+        # 扫描时尚未插入的结果行不再需要
+        self.result_queue = queue.SimpleQueue()
+        self._pending_rows = []
+        self._pending_pos = 0
+        
+        results = self.scanned_files
+        format_size = FileTransferEngine.format_size
+        self.file_tree.delete(*self.file_tree.get_children())
+        shown = self.selection[:self.RESULT_VIEW_LIMIT]
+        for index in shown:
+            file_name, file_ext = os.path.splitext(results.names[index])
+            size = results.sizes[index]
+            self.file_tree.insert("", tk.END, values=(file_name, file_ext.lower(),
+                                                      format_size(None if size < 0 else size), results.path(index)))
+        
+        text = f"筛选出 {len(self.selection)} 个文件（共 {len(results)} 个），{format_size(self.result_index.total_size(self.selection))}"
+        if len(shown) < len(self.selection):
+            text += f"，显示前 {len(shown)} 个"
+        self.selection_label.config(text=text)
+        self.update_transfer_buttons()
+    
+    def selected_files(self):
+        """返回要转移的文件：设置了筛选条件时只包含筛选出的文件"""
+        if self.selection is None or len(self.selection) == len(self.scanned_files):
+            return self.scanned_files
+        return self.scanned_files.subset(self.selection)
+    
     def reset_ui(self):
         """重置UI状态"""
+        self.apply_engine_updates()
         self.is_running = False
         self.scan_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
@@ -287,8 +590,17 @@ class FileTransferTool:
             messagebox.showerror("错误", "请选择目标文件夹")
             return
             
-        if not self.scanned_files:
-            messagebox.showerror("错误", "没有可转移的文件，请先扫描文件")
+        streaming = self.streaming_mode.get()
+        files = None if streaming else self.selected_files()
+        if not streaming and not files:
+            messagebox.showerror("错误", "没有可转移的文件，请先扫描文件或调整筛选条件")
+            return
+        
+        # 在界面线程中读取选项，流式转移在转移过程中扫描，也需要在这里编译分类器
+        try:
+            engine = self.create_engine()
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
             return
             
         # 确认对话框
@@ -297,282 +609,112 @@ class FileTransferTool:
         confirm_msg += f"源文件夹: {source}\n"
         confirm_msg += f"目标文件夹: {target}\n"
         confirm_msg += f"操作模式: {mode_text}\n"
-        confirm_msg += f"文件数量: {len(self.scanned_files)}\n"
+        if mode == "move":
+            same_volume = engine.is_same_device(source, target)
+            confirm_msg += f"移动方式: {engine.describe_move_strategy(same_volume, engine.checksum)}\n"
+        if streaming:
+            confirm_msg += "文件数量: 边扫描边转移，数量在扫描过程中确定\n"
+        elif len(files) < len(self.scanned_files):
+            confirm_msg += f"文件数量: {len(files)}（从 {len(self.scanned_files)} 个扫描结果中筛选）\n"
+        else:
+            confirm_msg += f"文件数量: {len(files)}\n"
         
         if not messagebox.askyesno("确认", confirm_msg):
             return
             
         self.is_running = True
+        self.engine = engine
         self.copy_button.config(state=tk.DISABLED)
         self.move_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
         
         # 在新线程中执行转移
-        threading.Thread(target=self.transfer_files_thread, args=(source, target, mode), daemon=True).start()
+        args = (source, target, mode, streaming, self.use_scan_index.get(), files)
+        threading.Thread(target=self.transfer_files_thread, args=args, daemon=True).start()
         
-    def transfer_files_thread(self, source, target, mode):
-        """在后台线程中转移文件"""
+    def transfer_files_thread(self, source, target, mode, streaming=False, use_index=False, files=None):
+        """在后台线程中转移文件，files 为要转移的扫描结果"""
         try:
-            self.transfer_files(source, target, mode)
+            engine = self.engine
+            if streaming:
+                engine.transfer_files(source, target, mode, files=engine.stream_files(source, use_index))
+            else:
+                engine.scanned_files = files
+                engine.transfer_files(source, target, mode)
             # 转移完成后更新UI
             self.root.after(0, self.transfer_complete)
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("错误", f"转移过程中发生错误: {str(e)}"))
+            self.root.after(0, lambda message=str(e): messagebox.showerror("错误", f"转移过程中发生错误: {message}"))
             self.root.after(0, self.reset_transfer_ui)
             
+    def resume_transfer_button(self):
+        """继续未完成任务按钮点击事件"""
+        if self.is_running:
+            return
+        
+        folder = filedialog.askdirectory(title="选择要继续的备份文件夹", initialdir=self.target_path.get() or None)
+        if not folder:
+            return
+        if not TransferJournal.exists(folder):
+            messagebox.showerror("错误", "该文件夹中没有转移日志，无法继续")
+            return
+        if not messagebox.askyesno("确认", f"确定要继续该备份文件夹中未完成的任务吗？\n\n备份文件夹: {folder}\n"):
+            return
+        try:
+            self.engine = self.create_engine()
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+            return
+        
+        self.is_running = True
+        self.copy_button.config(state=tk.DISABLED)
+        self.move_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+        
+        threading.Thread(target=self.resume_transfer_thread, args=(folder,), daemon=True).start()
+    
+    def resume_transfer_thread(self, backup_folder):
+        """在后台线程中继续未完成的任务"""
+        try:
+            self.engine.resume_transfer(backup_folder)
+            self.root.after(0, self.transfer_complete)
+        except Exception as e:
+            self.root.after(0, lambda message=str(e): messagebox.showerror("错误", f"继续任务时发生错误: {message}"))
+            self.root.after(0, self.reset_transfer_ui)
+    
+    def update_transfer_buttons(self):
+        """有扫描结果或启用流式转移时启用复制和移动按钮"""
+        if self.is_running:
+            return
+        has_files = self.scanned_files if self.selection is None else self.selection
+        state = tk.NORMAL if has_files or self.streaming_mode.get() else tk.DISABLED
+        self.copy_button.config(state=state)
+        self.move_button.config(state=state)
+    
     def transfer_complete(self):
         """转移完成后的UI更新"""
+        self.apply_engine_updates()
         self.is_running = False
-        self.copy_button.config(state=tk.NORMAL if self.scanned_files else tk.DISABLED)
-        self.move_button.config(state=tk.NORMAL if self.scanned_files else tk.DISABLED)
+        self.update_transfer_buttons()
         self.stop_button.config(state=tk.DISABLED)
         messagebox.showinfo("转移完成", "文件转移操作已完成")
         
     def reset_transfer_ui(self):
         """重置转移UI状态"""
+        self.apply_engine_updates()
         self.is_running = False
-        self.copy_button.config(state=tk.NORMAL if self.scanned_files else tk.DISABLED)
-        self.move_button.config(state=tk.NORMAL if self.scanned_files else tk.DISABLED)
+        self.update_transfer_buttons()
         self.stop_button.config(state=tk.DISABLED)
         
     def stop_transfer(self):
         """停止文件转移"""
         self.is_running = False
-        self.copy_button.config(state=tk.NORMAL if self.scanned_files else tk.DISABLED)
-        self.move_button.config(state=tk.NORMAL if self.scanned_files else tk.DISABLED)
+        if self.engine is not None:
+            self.engine.stop()
+        self.update_transfer_buttons()
         self.stop_button.config(state=tk.DISABLED)
         self.log("用户取消了文件转移操作")
         self.update_status("已取消")
-    
-    def transfer_files(self, source, target, mode):
-        """转移文件"""
-        try:
-            organize = self.organize_by_type.get()
-            
-            # 创建带时间戳的备份文件夹
-            current_time = time.strftime("%Y%m%d_%H%M%S")
-            backup_folder = os.path.join(target, f"备份_{current_time}")
-            os.makedirs(backup_folder, exist_ok=True)
-            
-            self.log(f"已创建备份文件夹: {backup_folder}")
-            
-            # 获取已扫描的文件列表
-            files = self.scanned_files
-            if not files:
-                self.log("没有找到符合条件的文件")
-                self.update_status("没有找到符合条件的文件")
-                return
-            
-            self.log(f"找到 {len(files)} 个文件")
-            self.update_status(f"找到 {len(files)} 个文件，准备转移...")
-            
-            # 按类型组织文件
-            if organize:
-                # 创建分类文件夹
-                file_types = set()
-                for file_info in files:
-                    file_type = file_info['type']
-                    file_types.add(file_type)
-                
-                for file_type in file_types:
-                    type_folder = os.path.join(backup_folder, file_type)
-                    os.makedirs(type_folder, exist_ok=True)
-            
-            # 转移文件
-            success_count = 0
-            fail_count = 0
-            
-            for i, file_info in enumerate(files):
-                if not self.is_running:
-                    break
-                
-                try:
-                    file_path = file_info['path']
-                    filename = os.path.basename(file_path)
-                    file_type = file_info['type']
-                    
-                    # 确定目标路径
-                    if organize:
-                        target_dir = os.path.join(backup_folder, file_type)
-                    else:
-                        target_dir = backup_folder
-                    
-                    target_path = os.path.join(target_dir, filename)
-                    
-                    # 如果目标文件已存在，添加序号
-                    if os.path.exists(target_path):
-                        base, ext = os.path.splitext(filename)
-                        counter = 1
-                        while os.path.exists(os.path.join(target_dir, f"{base}_{counter}{ext}")):
-                            counter += 1
-                        target_path = os.path.join(target_dir, f"{base}_{counter}{ext}")
-                    
-                    # 执行转移
-                    if mode == "copy":
-                        shutil.copy2(file_path, target_path)
-                        operation = "复制"
-                    else:
-                        shutil.move(file_path, target_path)
-                        operation = "移动"
-                    
-                    success_count += 1
-                    self.log(f"{operation}成功: {filename} -> {os.path.relpath(target_path, target)}")
-                    
-                    # 更新进度条
-                    progress = int((i + 1) / len(files) * 100)
-                    self.progress.config(value=progress)
-                    self.update_status(f"处理中... {i+1}/{len(files)} ({progress}%)")
-                    
-                except Exception as e:
-                    fail_count += 1
-                    self.log(f"处理失败: {file_path} - {str(e)}")
-            
-            # 完成
-            if self.is_running:
-                self.log(f"转移完成! 成功: {success_count}, 失败: {fail_count}")
-                self.update_status(f"转移完成! 成功: {success_count}, 失败: {fail_count}")
-            else:
-                self.log("转移已停止")
-                self.update_status("转移已停止")
-                
-        except Exception as e:
-            self.log(f"转移过程中发生错误: {str(e)}")
-            self.update_status(f"转移失败: {str(e)}")
-            raise
-    
-    def scan_files(self, source_dir):
-        """扫描源文件夹中的文件"""
-        self.scanned_files = []  # 清空之前的扫描结果
-        
-        # 检查是否是微信目录，如果是，只扫描msg文件夹
-        if "wechat" in source_dir.lower() or "weixin" in source_dir.lower():
-            # 查找msg文件夹
-            msg_dir = None
-            for root, dirs, filenames in os.walk(source_dir):
-                for dirname in dirs:
-                    if dirname.lower() == "msg":
-                        msg_dir = os.path.join(root, dirname)
-                        break
-                if msg_dir:
-                    break
-            
-            # 如果找到msg文件夹，只扫描该文件夹
-            if msg_dir:
-                self.log(f"检测到微信目录，只扫描msg文件夹: {msg_dir}")
-                source_dir = msg_dir
-            else:
-                self.log("在微信目录中未找到msg文件夹，将扫描整个目录")
-        
-        # 获取目标文件夹路径
-        target_dir = self.target_path.get()
-        
-        for root, dirs, filenames in os.walk(source_dir):
-            # 跳过系统目录
-            dirs[:] = [d for d in dirs if not self.should_skip_dir(d)]
-            
-            # 检查当前目录是否是目标文件夹或其子目录
-            if target_dir and (root == target_dir or root.startswith(target_dir + os.sep)):
-                self.log(f"跳过目标文件夹及其子目录: {root}")
-                continue
-            
-            for filename in filenames:
-                if not self.is_running:
-                    break
-                
-                file_path = os.path.join(root, filename)
-                
-                # 跳过系统文件和隐藏文件
-                if self.should_skip_file(filename):
-                    continue
-                
-                # 确定文件类型
-                file_type = self.get_file_type(filename)
-                
-                # 严格按照常用文件类型进行筛选，只处理FILE_TYPES中定义的文件类型和用户自定义的临时类型
-                if file_type == '其他':
-                    continue
-                
-                # 获取文件大小
-                try:
-                    file_size = os.path.getsize(file_path)
-                    # 格式化文件大小
-                    if file_size < 1024:
-                        size_str = f"{file_size} B"
-                    elif file_size < 1024 * 1024:
-                        size_str = f"{file_size / 1024:.2f} KB"
-                    elif file_size < 1024 * 1024 * 1024:
-                        size_str = f"{file_size / (1024 * 1024):.2f} MB"
-                    else:
-                        size_str = f"{file_size / (1024 * 1024 * 1024):.2f} GB"
-                except:
-                    size_str = "未知"
-                
-                # 获取文件名和扩展名
-                file_name = os.path.splitext(filename)[0]
-                file_ext = os.path.splitext(filename)[1].lower()
-                
-                # 添加到扫描结果
-                file_info = {
-                    'path': file_path,
-                    'name': file_name,
-                    'ext': file_ext,
-                    'size': file_size,
-                    'type': file_type
-                }
-                self.scanned_files.append(file_info)
-                
-                # 在UI中添加到Treeview
-                self.root.after(0, lambda fn=file_name, fe=file_ext, fs=size_str, fp=file_path: 
-                               self.file_tree.insert("", tk.END, values=(fn, fe, fs, fp)))
-        
-        self.log(f"扫描完成，共找到 {len(self.scanned_files)} 个文件")
-        return self.scanned_files
-    
-    def should_skip_dir(self, dirname):
-        """检查是否应该跳过目录"""
-        dirname_lower = dirname.lower()
-        return any(skip.lower() in dirname_lower for skip in self.SKIP_DIRS)
-    
-    def should_skip_file(self, filename):
-        """检查是否应该跳过文件"""
-        # 跳过隐藏文件
-        if filename.startswith('.'):
-            return True
-        
-        # 跳过系统文件
-        if filename.lower() in ['thumbs.db', 'desktop.ini', 'ds_store']:
-            return True
-        
-        # 跳过代码格式文件
-        _, ext = os.path.splitext(filename)
-        if ext.lower() in self.CODE_FILE_EXTENSIONS:
-            return True
-        
-        # 跳过程序类文件
-        if ext.lower() in self.PROGRAM_FILE_EXTENSIONS:
-            return True
-        
-        return False
-    
-    def get_file_type(self, filename):
-        """根据文件扩展名确定文件类型"""
-        _, ext = os.path.splitext(filename)
-        ext = ext.lower()
-        
-        # 首先检查是否匹配用户自定义的扩展名
-        custom_exts = self.custom_extensions.get()
-        if custom_exts:
-            # 分割用户输入的扩展名列表
-            custom_list = [e.strip().lower() for e in custom_exts.split(',') if e.strip()]
-            if ext in custom_list:
-                return '临时类型'
-        
-        # 然后检查预定义的文件类型，但只返回用户选择的类型
-        for file_type, extensions in self.FILE_TYPES.items():
-            if ext in extensions and self.file_type_vars[file_type].get():
-                return file_type
-        
-        return '其他'
 
 
 def main():
@@ -583,4 +725,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()